@@ -24,16 +24,19 @@ import dataclasses
 import datetime
 import enum
 import math
+import mmap
 import os
 import pathlib
+import pickle
 import re
 import types
 import typing
 import struct
+import sys
 import collections.abc
 import io
-import email
 import collections.abc as col_abc
+import concurrent.futures
 
 from .common import KeySearch, is_keysearch_hit
 
@@ -45,6 +48,37 @@ __contact__ = "Alex Caithness"
 
 EPOCH = datetime.datetime(1970, 1, 1)
 
+# version, last write timestamp, dirty flag, kb written
+_INDEX_HEADER_STRUCT = struct.Struct(">IIII")
+
+# sha1 hash, frecency, origin attributes hash, onStartTime, onStopTime, content type, flags
+_RECORD_STRUCT = struct.Struct(">20sfqHHBI")
+
+# single fields from a 41 byte index record, for reading a column of the record table at a time
+_RECORD_SHA1_STRUCT = struct.Struct(">20s21x")
+_RECORD_FRECENCY_STRUCT = struct.Struct(">20xf17x")
+_RECORD_FLAGS_STRUCT = struct.Struct(">37xI")
+
+# a cache key with its tags in the order Firefox writes them (see: CacheFileUtils::AppendKeyPrefix): origin attributes
+# suffix, anonymous, private, id enhance, then the url. Values have their commas escaped by doubling them.
+_CANONICAL_CACHE_KEY_RE = re.compile(r"(?:O([^,]*(?:,,[^,]*)*),)?(a,)?(p,)?(?:~([^,]*(?:,,[^,]*)*),)?:(.*)", re.DOTALL)
+
+_ASCII_LOWER = bytes.maketrans(bytes(range(0x41, 0x5b)), bytes(range(0x61, 0x7b)))
+
+# metadata elements with values drawn from a small set (e.g. GET, POST) which are worth sharing between entries
+_INTERNED_ELEMENT_VALUES = frozenset({"request-method"})
+
+# fixed part of the entry metadata following the chunk hashes: version, fetch count, last fetched,
+# last modified, frecency, expiration time, key size, flags
+_META_FIXED_STRUCT = struct.Struct(">IIIIfIII")
+
+# bumped whenever what's stored in a metadata cache file (see MozillaCache) changes, so old files are ignored
+_METADATA_CACHE_FORMAT_VERSION = 1
+
+# primitives used by BinaryReader (all big-endian)
+_S_I16, _S_U16, _S_I32, _S_U32, _S_I64, _S_U64, _S_F32, _S_F64 = (
+    struct.Struct(fmt) for fmt in (">h", ">H", ">i", ">I", ">q", ">Q", ">f", ">d"))
+
 
 def decode_unix_time(seconds: int) -> datetime.datetime:
     return EPOCH + datetime.timedelta(seconds=seconds)
@@ -55,17 +89,35 @@ def parse_http_headers(raw_headers: str):
         return "", "", {}
     split = raw_headers.splitlines(keepends=False)
     version, status = split[0].strip().split(None, 1)
-    remains = "\r\n".join(split[1:])
-    message = email.message_from_string(remains)
-    headers = types.MappingProxyType(dict(message.items()))
 
-    return version, status, headers
+    # Field names are stored lowercased so that lookups don't need to worry about case. As before, where a field
+    # is repeated the last value wins.
+    headers = {}
+    name = None
+    for line in split[1:]:
+        if not line:
+            break  # end of the header block
+        if line[0] in " \t":
+            # obsolete line folding, continues the previous field's value
+            if name is not None:
+                headers[name] = f"{headers[name]} {line.strip()}"
+            continue
+        name, colon, value = line.partition(":")
+        if not colon:
+            name = None
+            continue
+        name = sys.intern(name.strip().lower())
+        headers[name] = value.strip()
+
+    return version, status, types.MappingProxyType(headers)
 
 
 class BinaryReader:
     """
     Utility class which wraps a BinaryIO and provides reading for a bunch of data types we need to do the cache stuff
     """
+    __slots__ = ("_stream", "_closed")
+
     def __init__(self, stream: typing.BinaryIO):
         self._stream = stream
         self._closed = False
@@ -74,6 +126,20 @@ class BinaryReader:
     def from_bytes(cls, buffer: bytes):
         return cls(io.BytesIO(buffer))
 
+    @classmethod
+    def from_path(cls, path: pathlib.Path):
+        """
+        Memory maps the file at path so that reads are copied straight out of the mapping rather than going
+        through the buffered file object for every primitive.
+
+        :param path: path of the file to read
+        """
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can't be mapped
+                return cls(io.BytesIO(b""))
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
     def close(self):
         self._stream.close()
         self._closed = True
@@ -91,13 +157,23 @@ class BinaryReader:
         return self._stream.seek(offset, whence)
 
     def read_raw(self, count: int) -> bytes:
-        start_offset = self._stream.tell()
         result = self._stream.read(count)
         if len(result) != count:
+            # the start offset is only needed for the message, so is worked back from where the read finished
+            start_offset = self._stream.tell() - len(result)
             raise ValueError(
                 f"Could not read all of the data starting at {start_offset}. Expected: {count}; got {len(result)}")
         return result
 
+    def read_struct(self, fixed_struct: struct.Struct) -> tuple:
+        """
+        Reads and unpacks a fixed size structure in one go, rather than reading each of its fields separately.
+
+        :param fixed_struct: the (precompiled) struct to unpack
+        :return: the unpacked values
+        """
+        return fixed_struct.unpack(self.read_raw(fixed_struct.size))
+
     def read_until_end(self) -> bytes:
         return self._stream.read()
 
@@ -105,36 +181,28 @@ class BinaryReader:
         return self.read_raw(count).decode("utf-8")
 
     def read_int16(self) -> int:
-        raw = self.read_raw(2)
-        return struct.unpack(">h", raw)[0]
+        return _S_I16.unpack(self.read_raw(2))[0]
 
     def read_int32(self) -> int:
-        raw = self.read_raw(4)
-        return struct.unpack(">i", raw)[0]
+        return _S_I32.unpack(self.read_raw(4))[0]
 
     def read_int64(self) -> int:
-        raw = self.read_raw(8)
-        return struct.unpack(">q", raw)[0]
+        return _S_I64.unpack(self.read_raw(8))[0]
 
     def read_uint16(self) -> int:
-        raw = self.read_raw(2)
-        return struct.unpack(">H", raw)[0]
+        return _S_U16.unpack(self.read_raw(2))[0]
 
     def read_uint32(self) -> int:
-        raw = self.read_raw(4)
-        return struct.unpack(">I", raw)[0]
+        return _S_U32.unpack(self.read_raw(4))[0]
 
     def read_uint64(self) -> int:
-        raw = self.read_raw(8)
-        return struct.unpack(">Q", raw)[0]
+        return _S_U64.unpack(self.read_raw(8))[0]
 
     def read_single(self) -> float:
-        raw = self.read_raw(4)
-        return struct.unpack(">f", raw)[0]
+        return _S_F32.unpack(self.read_raw(4))[0]
 
     def read_double(self) -> float:
-        raw = self.read_raw(8)
-        return struct.unpack(">d", raw)[0]
+        return _S_F64.unpack(self.read_raw(8))[0]
 
     def read_datetime(self) -> datetime.datetime:
         return decode_unix_time(self.read_uint32())
@@ -162,8 +230,16 @@ class CacheEntryContentType(enum.IntEnum):
     WASM = 6
 
 
+# the values are contiguous from 0 so members can be looked up by index, which is much cheaper than the enum's own
+# lookup when done for every record in an index
+_CONTENT_TYPE_LOOKUP = tuple(sorted(CacheEntryContentType))
+
+
 class CacheKey:
     # netwerk/cache2/CacheFileUtils.cpp
+    __slots__ = (
+        "_raw_key", "_is_anon", "_url", "_sync_attributes_with_private_browsing", "_id_enhance", "_origin_suffix")
+
     def __init__(self, raw_key: str):
         self._raw_key = raw_key
         self._is_anon = False
@@ -196,58 +272,71 @@ class CacheKey:
         return self._raw_key
 
     @staticmethod
-    def _read_value(s: io.BytesIO) -> str:
-        out = io.BytesIO()
-        while True:
-            c = s.read(1)
-            if not c:
-                raise ValueError("unexpected end of key while reading a value")
-            if c == b",":
-                comma_check = s.read(1)
-                if not comma_check:
-                    raise ValueError("unexpected end of key while reading a value")
-                elif comma_check == b",":  # escaped comma
-                    out.write(c)
-                else:
-                    # back past the check and the original comma as the consumer expects it
-                    s.seek(-2, os.SEEK_CUR)
-                    break
-            else:
-                out.write(c)
+    def _read_value(key: str, offset: int) -> tuple[str, int]:
+        """
+        Reads a value from the key, resolving escaped (doubled) commas.
 
-        result = out.getvalue()
-        out.close()
-        return result.decode("ascii")
+        :param key: the key
+        :param offset: the offset of the start of the value
+        :return: the value and the offset of the comma which delimits it (as the consumer expects it)
+        """
+        comma = key.find(",", offset)
+        while comma != -1 and comma + 1 < len(key) and key[comma + 1] == ",":
+            # escaped comma, skip over both of them
+            comma = key.find(",", comma + 2)
+        if comma == -1 or comma + 1 >= len(key):
+            raise ValueError("unexpected end of key while reading a value")
+
+        value = key[offset:comma]
+        # no escaped commas is by far the most common case, in which case the value is used as sliced
+        return (value.replace(",,", ",") if ",," in value else value), comma
 
     def _read_tags(self):
-        key = io.BytesIO(self._raw_key.encode("ascii"))  # need to do negative seeks
-        while True:
-            tag = key.read(1)
-            if not tag:
-                break
-            elif tag == b":":  # Final tag URL follows
-                self._url = key.read().decode("ascii")
+        key = self._raw_key
+        if not key.isascii():
+            raise ValueError("Cache key contains non-ASCII characters")
+
+        # practically every key has its tags in the canonical order, which can be parsed in one go; anything else goes
+        # through the tag by tag parse below
+        if match := _CANONICAL_CACHE_KEY_RE.fullmatch(key):
+            origin_suffix, is_anon, sync_private, id_enhance, self._url = match.groups()
+            if origin_suffix is not None:
+                self._origin_suffix = origin_suffix.replace(",,", ",")
+            if id_enhance is not None:
+                self._id_enhance = id_enhance.replace(",,", ",")
+            self._is_anon = is_anon is not None
+            self._sync_attributes_with_private_browsing = sync_private is not None
+            return
+
+        i = 0
+        while i < len(key):
+            tag = key[i]
+            i += 1
+            if tag == ":":  # Final tag URL follows
+                self._url = key[i:]
                 break
-            elif tag == b"O":  # origin attributes
-                self._origin_suffix = self._read_value(key)
-            elif tag == b"p":
+            elif tag == "O":  # origin attributes
+                self._origin_suffix, i = self._read_value(key, i)
+            elif tag == "p":
                 self._sync_attributes_with_private_browsing = True
-            elif tag == b"a":
+            elif tag == "a":
                 self._is_anon = True
-            elif tag == b"~":
-                self._id_enhance = self._read_value(key)
+            elif tag == "~":
+                self._id_enhance, i = self._read_value(key, i)
             else:
-                raise ValueError(f"Unexpected tag in cache key: {tag}")
+                raise ValueError(f"Unexpected tag in cache key: {tag.encode('ascii')}")
 
-            comma = key.read(1)
-            if comma != b",":
+            if key[i:i + 1] != ",":
                 raise ValueError(f"Expected a comma after a tag in a cache key")
+            i += 1
 
             # tags b and i are related to an old format which for now we count as invalid
 
 
 @dataclasses.dataclass(frozen=True)
 class CacheIndexHeader:
+    SIZE = _INDEX_HEADER_STRUCT.size
+
     # /netwerk/cache2/CacheIndex.h
     version: int
     last_write_timestamp: datetime.datetime
@@ -256,12 +345,9 @@ class CacheIndexHeader:
 
     @classmethod
     def from_reader(cls, reader: BinaryReader):
-        version = reader.read_uint32()
-        last_write = reader.read_datetime()
-        is_dirty = reader.read_uint32()
-        kb_written = reader.read_uint32()
+        version, last_write, is_dirty, kb_written = reader.read_struct(_INDEX_HEADER_STRUCT)
 
-        return CacheIndexHeader(version, last_write, is_dirty, kb_written)
+        return CacheIndexHeader(version, decode_unix_time(last_write), is_dirty, kb_written)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -309,44 +395,150 @@ class CacheIndexRecord:
     def has_alt_data(self) -> bool:
         return self.flags & 0x02000000 != 0
 
+    @classmethod
+    def from_unpacked(cls, values: tuple):
+        sha1, frecency, origin_attrs_hash, on_start, on_stop, content_type, flags = values
+        if content_type < len(_CONTENT_TYPE_LOOKUP):
+            content_type = _CONTENT_TYPE_LOOKUP[content_type]
+        else:
+            content_type = CacheEntryContentType(content_type)  # will raise for an unknown value
+
+        # go through the dataclass's own __init__ rather than filling in __dict__ directly: it's a little slower per
+        # record, but it keeps working if the class gains slots, a __post_init__ or field validation
+        return cls(sha1.hex(), frecency, origin_attrs_hash, on_start, on_stop, content_type, flags)
+
+    @classmethod
+    def from_buffer(cls, buffer: bytes, offset: int=0):
+        return cls.from_unpacked(_RECORD_STRUCT.unpack_from(buffer, offset))
+
     @classmethod
     def from_reader(cls, reader: BinaryReader):
-        sha1 = reader.read_raw(20).hex()
-        frecency = reader.read_single()
-        origin_attrs_hash = reader.read_int64()
-        on_start = reader.read_uint16()
-        on_stop = reader.read_uint16()
-        content_type = CacheEntryContentType(reader.read_raw(1)[0])
-        flags = reader.read_uint32()
+        return cls.from_unpacked(reader.read_struct(_RECORD_STRUCT))
+
 
-        return cls(sha1, frecency, origin_attrs_hash, on_start, on_stop, content_type, flags)
+@dataclasses.dataclass(frozen=True)
+class CacheIndexFlagColumns:
+    """
+    The decoded flags for every record in a cache index, with one tuple per flag (in record order) rather than
+    one object per record
+    """
+    # /netwerk/cache2/CacheIndex.h
+    file_size_kb: tuple[int, ...]
+    is_initialized: tuple[bool, ...]
+    is_anonymous: tuple[bool, ...]
+    is_removed: tuple[bool, ...]
+    is_dirty: tuple[bool, ...]
+    is_fresh: tuple[bool, ...]
+    is_pinned: tuple[bool, ...]
+    has_alt_data: tuple[bool, ...]
 
 
 class CacheIndexFile:
     # /netwerk/cache2/CacheIndex.h
+    __slots__ = ("_header", "_record_data")
+
     def __init__(self, header: CacheIndexHeader, records: collections.abc.Iterable[CacheIndexRecord]):
+        """
+        :param header: the header of the index
+        :param records: the records of the index
+        """
         self._header = header
-        self._records = tuple(records)
+        # We hold on to the raw record table and only create CacheIndexRecord objects as they are asked for;
+        # the unpacking of the whole table happens in C via Struct.iter_unpack. Records passed in are packed
+        # back into the same form (see from_record_data for building an index from the table directly).
+        self._record_data = b"".join(
+            _RECORD_STRUCT.pack(
+                bytes.fromhex(record.sha1_hash), record.frecency, record.origin_attrs_hash, record.onStartTime,
+                record.onStopTime, record.content_type, record.flags)
+            for record in records)
+
+    @classmethod
+    def from_record_data(cls, header: CacheIndexHeader, record_data: bytes) -> "CacheIndexFile":
+        """
+        Creates an index over the raw record table, without creating a CacheIndexRecord for each record up front.
+
+        :param header: the header of the index
+        :param record_data: the raw record table from the index; its length should be a multiple of
+        CacheIndexRecord.SIZE
+        """
+        if len(record_data) % CacheIndexRecord.SIZE != 0:
+            raise ValueError(f"record_data length is not a multiple of {CacheIndexRecord.SIZE}")
+        index = cls.__new__(cls)
+        index._header = header
+        index._record_data = bytes(record_data)
+        return index
 
     @classmethod
     def from_file(cls, path: pathlib.Path):
-        with BinaryReader(path.open("rb")) as reader:
+        # the records make up the rest of the file bar a trailing hash, so the record count comes from the file
+        # size and the whole table is read in one go rather than probing the stream for every record
+        record_count = max(0, path.stat().st_size - CacheIndexHeader.SIZE) // CacheIndexRecord.SIZE
+        with BinaryReader.from_path(path) as reader:
             header = CacheIndexHeader.from_reader(reader)
-            records = []
-            while True:
-                if not reader.can_read(CacheIndexRecord.SIZE):
-                    break
-                records.append(CacheIndexRecord.from_reader(reader))
+            record_data = reader.read_raw(record_count * CacheIndexRecord.SIZE)
 
-        return CacheIndexFile(header, records)
+        return cls.from_record_data(header, record_data)
 
     @property
     def header(self):
         return self._header
 
+    def __len__(self) -> int:
+        return len(self._record_data) // CacheIndexRecord.SIZE
+
+    def __getitem__(self, index: int) -> CacheIndexRecord:
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("CacheIndexFile record index out of range")
+        return CacheIndexRecord.from_buffer(self._record_data, index * CacheIndexRecord.SIZE)
+
+    def sha1_hashes(self) -> tuple[str, ...]:
+        """
+        :return: the sha1 hash (as hex) of every record, in record order
+        """
+        return tuple(h.hex() for h, in _RECORD_SHA1_STRUCT.iter_unpack(self._record_data))
+
+    def frecencies(self) -> tuple[float, ...]:
+        """
+        :return: the frecency of every record, in record order
+        """
+        return tuple(f for f, in _RECORD_FRECENCY_STRUCT.iter_unpack(self._record_data))
+
+    def flags(self) -> tuple[int, ...]:
+        """
+        :return: the raw flags of every record, in record order (see also flags_decoded)
+        """
+        return tuple(f for f, in _RECORD_FLAGS_STRUCT.iter_unpack(self._record_data))
+
+    @property
+    def _records(self) -> tuple[CacheIndexRecord, ...]:
+        # what the records were held as before the raw record table was kept instead
+        return tuple(self.records)
+
     @property
-    def records(self):
-        yield from self._records
+    def records(self) -> collections.abc.Iterable[CacheIndexRecord]:
+        for values in _RECORD_STRUCT.iter_unpack(self._record_data):
+            yield CacheIndexRecord.from_unpacked(values)
+
+    def flags_decoded(self) -> CacheIndexFlagColumns:
+        """
+        Decodes the flags of every record in one pass without building CacheIndexRecord objects.
+
+        :return: a CacheIndexFlagColumns with a tuple for each flag, in record order
+        """
+        flags = self.flags()
+        return CacheIndexFlagColumns(
+            tuple(f & 0x00ffffff for f in flags),
+            tuple(f & 0x80000000 != 0 for f in flags),
+            tuple(f & 0x40000000 != 0 for f in flags),
+            tuple(f & 0x20000000 != 0 for f in flags),
+            tuple(f & 0x10000000 != 0 for f in flags),
+            tuple(f & 0x08000000 != 0 for f in flags),
+            tuple(f & 0x04000000 != 0 for f in flags),
+            tuple(f & 0x02000000 != 0 for f in flags),
+        )
 
 
 @dataclasses.dataclass(frozen=True)
@@ -377,19 +569,18 @@ class CacheFileMetadata:
     @classmethod
     def from_reader(cls, reader: BinaryReader, chunk_count: int):
         metadata_hash = reader.read_uint32()
-        chunk_hashes = tuple(reader.read_uint16() for _ in range(chunk_count))  # currently I believe there can only be 1 or 0
-        version = reader.read_uint32()
+        # currently I believe there can only be 1 or 0
+        chunk_hashes = struct.unpack(f">{chunk_count}H", reader.read_raw(2 * chunk_count))
+        (
+            version, fetch_count, last_fetched, last_modified, frecency, expiration_time, key_size, flags
+        ) = reader.read_struct(_META_FIXED_STRUCT)
 
         if version != 3:
             raise ValueError(f"Unsupported CacheFileMetadata version. Expected: 3; got: {version}")
 
-        fetch_count = reader.read_uint32()
-        last_fetched = reader.read_datetime()
-        last_modified = reader.read_datetime()
-        frecency = reader.read_single()
-        expiration_time = reader.read_datetime()
-        key_size = reader.read_uint32()
-        flags = reader.read_uint32()
+        last_fetched = decode_unix_time(last_fetched)
+        last_modified = decode_unix_time(last_modified)
+        expiration_time = decode_unix_time(expiration_time)
 
         key = reader.read_utf8(key_size + 1)  # + 1 as it should end with \0 which we can check
         if key.endswith("\0"):
@@ -398,7 +589,7 @@ class CacheFileMetadata:
             raise ValueError("Invalid metadata format (key does not end with \\0)")
 
         elements_raw = reader.read_until_end()
-        offset, = struct.unpack(">I", elements_raw[-4:])
+        offset, = _S_U32.unpack(elements_raw[-4:])
         elements_raw = elements_raw[0:-4]
         if elements_raw.endswith(b"\x00"):
             elements_raw = elements_raw[0:-1]  # check the final delimiting 0x00 is there and remove it
@@ -409,10 +600,15 @@ class CacheFileMetadata:
         if len(elements_raw_split) % 2 != 0:
             raise ValueError("Invalid metadata format (odd number of elements)")
 
-        elements = types.MappingProxyType({
-            elements_raw_split[i].decode("ascii").lower(): elements_raw_split[i + 1].decode("ascii")
-            for i in range(0, len(elements_raw_split), 2)
-        })
+        # keys and values alternate; keys are lowercased while still bytes so that only one string is made per key.
+        # The same handful of keys turn up in every entry, so they are interned to share a single copy of each.
+        parts = iter(elements_raw_split)
+        elements = dict(zip(
+            (sys.intern(k.translate(_ASCII_LOWER).decode("ascii")) for k in parts),
+            (v.decode("ascii") for v in parts)))
+        for element_name in _INTERNED_ELEMENT_VALUES.intersection(elements):
+            elements[element_name] = sys.intern(elements[element_name])
+        elements = types.MappingProxyType(elements)
 
         return cls(
             metadata_hash, chunk_hashes, version, fetch_count,
@@ -430,6 +626,8 @@ class CacheFile:
 
     _CHUNK_SIZE = 256 * 1024  # /netwerk/cache2/CacheFileChunk.h
 
+    __slots__ = ("_path", "_metadata", "_data", "_header")
+
     def __init__(self, path: pathlib.Path, metadata, cached_resource_data: bytes):
         self._path = path
         self._metadata = metadata
@@ -455,9 +653,26 @@ class CacheFile:
     def get_header_attribute(self, attribute: str):
         return self._header.get(attribute.lower())
 
+    @staticmethod
+    def _map_file(path: pathlib.Path) -> mmap.mmap:
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size < 4:
+                raise ValueError(f"Cache file {path} is too short to contain metadata")
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _read_metadata_from_mapping(path: pathlib.Path, mapped: mmap.mmap) -> CacheFileMetadata:
+        # read offset for metadata, and implicitly the data length, straight from the tail; no seeking required
+        offset, = _S_U32.unpack_from(mapped, len(mapped) - 4)
+        if offset > len(mapped) - 4:
+            raise ValueError(f"Metadata offset {offset} is beyond the end of the cache file {path}")
+        chunk_count = math.ceil(offset / CacheFile._CHUNK_SIZE)
+        with BinaryReader.from_bytes(mapped[offset:]) as reader:
+            return CacheFileMetadata.from_reader(reader, chunk_count)
+
     @classmethod
     def from_file(cls, path: pathlib.Path):
-        with BinaryReader(path.open("rb")) as reader:
+        with BinaryReader.from_path(path) as reader:
             # read offset for metadata, and implicitly the data length
             reader.seek(-4, os.SEEK_END)
             offset = reader.read_uint32()
@@ -470,17 +685,41 @@ class CacheFile:
 
         return cls(path, metadata, data)
 
+    @classmethod
+    def from_paths(
+            cls, paths: col_abc.Iterable[pathlib.Path], *, metadata_only=False,
+            max_workers: typing.Optional[int]=None) -> col_abc.Iterable[typing.Union["CacheFile", CacheFileMetadata]]:
+        """
+        Parses a batch of cache entry files using a pool of worker threads. Results are yielded in the same
+        order as paths.
+
+        :param paths: the paths of the cache entry files
+        :param metadata_only: if True, only the metadata is parsed (as per read_metadata) and CacheFileMetadata
+        objects are yielded rather than CacheFile objects
+        :param max_workers: the maximum number of worker threads (the default is as per ThreadPoolExecutor)
+        """
+        # Threads rather than processes: CacheFile objects hold a MappingProxyType, which can't be pickled to get it back
+        # from a worker process.
+        parse = cls.read_metadata if metadata_only else cls.from_file
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)  # as per ThreadPoolExecutor's default
+
+        # Executor.map would submit every path up front, so instead only a window of files (enough to keep the
+        # workers busy) is in flight at once and results are handed back as the consumer asks for them
+        max_pending = 2 * max_workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = collections.deque()
+            for path in paths:
+                pending.append(executor.submit(parse, path))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     @staticmethod
     def read_metadata(path: pathlib.Path) -> CacheFileMetadata:
-        with BinaryReader(path.open("rb")) as reader:
-            # read offset for metadata, and implicitly the data length
-            reader.seek(-4, os.SEEK_END)
-            offset = reader.read_uint32()
-            reader.seek(offset, os.SEEK_SET)
-            chunk_count = math.ceil(offset / CacheFile._CHUNK_SIZE)
-            metadata = CacheFileMetadata.from_reader(reader, chunk_count)
-
-        return metadata
+        with CacheFile._map_file(path) as mapped:
+            return CacheFile._read_metadata_from_mapping(path, mapped)
 
     @property
     def path(self) -> pathlib.Path:
@@ -497,83 +736,192 @@ class CacheFile:
 
 class MozillaCache:
     _ENTRIES_FOLDER_NAME = "entries"
+    # the metadata fields stored for each entry in a metadata cache file (see _metadata_to_cached)
+    _METADATA_CACHE_FIELDS = frozenset(field.name for field in dataclasses.fields(CacheFileMetadata))
 
-    def __init__(self, cache_folder: pathlib.Path):
+    def __init__(
+            self, cache_folder: pathlib.Path, *,
+            metadata_cache_path: typing.Optional[pathlib.Path]=None, invalidate_metadata_cache=False):
+        """
+        :param cache_folder: the cache2 folder
+        :param metadata_cache_path: optionally, the path of a file in which the parsed metadata of the cache entries is
+        kept between runs, so that entries which haven't changed (going by their size and modification time) don't
+        need parsing again. It's up to the caller where this goes - nothing is ever written to the cache folder. The
+        file is a pickle, so should only ever be one that was created by this class. A file that can't be read or
+        written, or that doesn't hold what's expected, just means that the entries are parsed as usual.
+        :param invalidate_metadata_cache: if True, any existing contents of the file at metadata_cache_path are ignored
+        (and replaced)
+        """
         if not cache_folder.is_dir():
             raise NotADirectoryError("cache_folder does not exist or it not a directory")
         self._cache_folder = cache_folder
+        self._metadata_cache_path = metadata_cache_path
+        self._invalidate_metadata_cache = invalidate_metadata_cache
         self._precached_metadata: typing.Optional[dict[CacheKey, tuple[pathlib.Path, CacheFileMetadata]]] = None
         self._url_key_lookup: typing.Optional[dict[str, list[CacheKey]]] = None
 
-    def _make_url_key_lookup(self):
-        if self._precached_metadata is None:
-            raise ValueError("_precached_metadata not set")
-        # We make a URL lookup as cache keys are unique based on the whole key, but with partitioning etc.
-        # it is possible for the same *URL* to be duplicated, and that's what consumers will want to use
-        # almost every time.
-        self._url_key_lookup = {}
-        for key in self._precached_metadata.keys():
-            self._url_key_lookup.setdefault(key.url, [])
-            self._url_key_lookup[key.url].append(key)
+    def _load_metadata_cache(self) -> dict[str, tuple[tuple[int, int], dict[str, typing.Any]]]:
+        # a missing, unreadable, out of date or malformed metadata cache just means that everything gets parsed
+        if self._invalidate_metadata_cache:
+            return {}
+        try:
+            with self._metadata_cache_path.open("rb") as f:
+                loaded = pickle.load(f)
+        except Exception:
+            # unpickling a corrupt file (or one that wasn't written by this class) can raise more or less anything
+            return {}
+        return loaded[1] if MozillaCache._is_valid_metadata_cache(loaded) else {}
+
+    @staticmethod
+    def _is_valid_metadata_cache(loaded: typing.Any) -> bool:
+        # (version, {file name: ((size, modification time), metadata fields)}) as written by _save_metadata_cache
+        if not (isinstance(loaded, tuple) and len(loaded) == 2):
+            return False
+        version, entries = loaded
+        if type(version) is not int or version != _METADATA_CACHE_FORMAT_VERSION or type(entries) is not dict:
+            return False
+        for name, value in entries.items():
+            if type(name) is not str or type(value) is not tuple or len(value) != 2:
+                return False
+            file_id, fields = value
+            if type(file_id) is not tuple or len(file_id) != 2 or any(type(x) is not int for x in file_id):
+                return False
+            if type(fields) is not dict or fields.keys() != MozillaCache._METADATA_CACHE_FIELDS:
+                return False
+        return True
+
+    def _save_metadata_cache(self, entries: dict[str, tuple[tuple[int, int], dict[str, typing.Any]]]):
+        # written alongside and then moved into place so that a failed write can't leave a truncated file behind.
+        # The metadata cache is only ever a shortcut, so failing to write it (e.g. the location is read-only) doesn't
+        # fail the parse that has just been done; it just means that the next run parses everything again.
+        temp_path = self._metadata_cache_path.with_name(self._metadata_cache_path.name + ".tmp")
+        try:
+            with temp_path.open("wb") as f:
+                pickle.dump((_METADATA_CACHE_FORMAT_VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._metadata_cache_path)
+        except Exception:
+            try:
+                temp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _metadata_to_cached(metadata: CacheFileMetadata) -> dict[str, typing.Any]:
+        # MappingProxyType can't be pickled, and the key is quicker to rebuild from the raw key than to unpickle
+        fields = vars(metadata).copy()
+        fields["key"] = metadata.key.raw_key
+        fields["elements"] = dict(metadata.elements)
+        return fields
+
+    @staticmethod
+    def _metadata_from_cached(fields: dict[str, typing.Any]) -> CacheFileMetadata:
+        return CacheFileMetadata(**{
+            **fields, "key": CacheKey(fields["key"]), "elements": types.MappingProxyType(fields["elements"])})
 
     def _precache_metadata(self):
         if self._precached_metadata is not None:
             raise ValueError("Precached metadata is already set")
         self._precached_metadata = {}
-        for file in (self._cache_folder / MozillaCache._ENTRIES_FOLDER_NAME).iterdir():
-            if not file.is_file():
-                continue
-
-            metadata = CacheFile.read_metadata(file)
+        # We make a URL lookup as cache keys are unique based on the whole key, but with partitioning etc.
+        # it is possible for the same *URL* to be duplicated, and that's what consumers will want to use
+        # almost every time. It's populated alongside the metadata rather than in a second pass over the keys.
+        self._url_key_lookup = collections.defaultdict(list)
+
+        # scandir rather than iterdir as the directory entries can answer is_file (and, on Windows, stat) themselves
+        with os.scandir(self._cache_folder / MozillaCache._ENTRIES_FOLDER_NAME) as scan:
+            entries = [entry for entry in scan if entry.is_file()]
+        files = [pathlib.Path(entry.path) for entry in entries]
+        metadata_list: list[typing.Optional[CacheFileMetadata]] = [None] * len(files)
+
+        use_metadata_cache = self._metadata_cache_path is not None
+        if use_metadata_cache:
+            # keyed by file name, each with the size and modification time of the file when it was parsed
+            previous_cached = self._load_metadata_cache()
+            cached = {}
+            file_ids = []
+            for i, entry in enumerate(entries):
+                stat = entry.stat()
+                file_ids.append((stat.st_size, stat.st_mtime_ns))
+                previous = previous_cached.get(entry.name)
+                if previous is not None and previous[0] == file_ids[i]:
+                    try:
+                        metadata_list[i] = self._metadata_from_cached(previous[1])
+                    except Exception:
+                        continue  # the right shape but bad values (e.g. an unparsable key), so parse this one again
+                    cached[entry.name] = previous
+
+        # each file is independent of the others, so those still to be parsed are shared out between worker threads
+        to_parse = [i for i, metadata in enumerate(metadata_list) if metadata is None]
+        parsed = CacheFile.from_paths((files[i] for i in to_parse), metadata_only=True)
+        for i, metadata in zip(to_parse, parsed):
+            metadata_list[i] = metadata
+            if use_metadata_cache:
+                cached[entries[i].name] = file_ids[i], self._metadata_to_cached(metadata)
+
+        for file, metadata in zip(files, metadata_list):
             if metadata.key in self._precached_metadata:
                 raise KeyError("Duplicate key (shouldn't be possible)")
 
             self._precached_metadata[metadata.key] = file, metadata
+            self._url_key_lookup[metadata.key.url].append(metadata.key)
+
+        if use_metadata_cache and cached != previous_cached:
+            self._save_metadata_cache(cached)
 
     def iter_metadata(self, *, url: typing.Optional[KeySearch]=None):
         self._precache_metadata()
-        self._make_url_key_lookup()
 
         for file, metadata in self._precached_metadata.values():
             yield metadata
 
     @staticmethod
-    def _check_attributes(cache_file: CacheFile, **kwargs):
-        for att_name, test_value in kwargs.items():
-            att_name = att_name.replace("_", "-").lower()
-            has_att = cache_file.has_header_attribute(att_name)
+    def _normalize_attribute_names(kwargs: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        # keyword arguments use underscores in place of hyphens; done once per search rather than for every file
+        return {att_name.replace("_", "-").lower(): test_value for att_name, test_value in kwargs.items()}
+
+    @staticmethod
+    def _check_attributes(cache_file: CacheFile, attributes: dict[str, typing.Any]):
+        """
+        :param cache_file: the cache file to test
+        :param attributes: the header fields to test for, as returned by _normalize_attribute_names
+        """
+        for att_name, test_value in attributes.items():
+            # header values are always strings, so None means that the field isn't present
+            att_value = cache_file.get_header_attribute(att_name)
+            has_att = att_value is not None
 
             if isinstance(test_value, bool):
-                return not (test_value ^ has_att)
+                if test_value ^ has_att:
+                    return False
+                continue
 
             if not has_att:
                 return False
 
-            if not is_keysearch_hit(test_value, cache_file.get_header_attribute(att_name)):
+            if not is_keysearch_hit(test_value, att_value):
                 return False
 
         return True
 
-    def _iter_cache_all(self, **kwargs):
+    def _iter_cache_all(self, attributes: dict[str, typing.Any]):
         for file in (self._cache_folder / MozillaCache._ENTRIES_FOLDER_NAME).iterdir():
             if not file.is_file():
                 continue
             cache_file = CacheFile.from_file(file)
-            if kwargs and not self._check_attributes(cache_file, **kwargs):
+            if attributes and not self._check_attributes(cache_file, attributes):
                 continue
 
             yield cache_file
 
-    def _iter_cache_filtered(self, search_url: KeySearch, **kwargs):
+    def _iter_cache_filtered(self, search_url: KeySearch, attributes: dict[str, typing.Any]):
         if self._precached_metadata is None:
             self._precache_metadata()
-            self._make_url_key_lookup()
 
         if isinstance(search_url, str):
             for key in self._url_key_lookup.get(search_url, []):
                 file, meta = self._precached_metadata[key]
                 cache_file = CacheFile.from_file(file)
-                if kwargs and not self._check_attributes(cache_file, **kwargs):
+                if attributes and not self._check_attributes(cache_file, attributes):
                     continue
                 yield cache_file
         elif isinstance(search_url, col_abc.Collection):
@@ -581,7 +929,7 @@ class MozillaCache:
                 for key in self._url_key_lookup.get(url, []):
                     file, meta = self._precached_metadata[key]
                     cache_file = CacheFile.from_file(file)
-                    if kwargs and not self._check_attributes(cache_file, **kwargs):
+                    if attributes and not self._check_attributes(cache_file, attributes):
                         continue
                     yield cache_file
         elif isinstance(search_url, re.Pattern):
@@ -590,7 +938,7 @@ class MozillaCache:
                     for key in keys:
                         file, meta = self._precached_metadata[key]
                         cache_file = CacheFile.from_file(file)
-                        if kwargs and not self._check_attributes(cache_file, **kwargs):
+                        if attributes and not self._check_attributes(cache_file, attributes):
                             continue
                         yield cache_file
         elif isinstance(search_url, col_abc.Callable):
@@ -599,7 +947,7 @@ class MozillaCache:
                     for key in keys:
                         file, meta = self._precached_metadata[key]
                         cache_file = CacheFile.from_file(file)
-                        if kwargs and not self._check_attributes(cache_file, **kwargs):
+                        if attributes and not self._check_attributes(cache_file, attributes):
                             continue
                         yield cache_file
         else:
@@ -620,9 +968,10 @@ class MozillaCache:
         and returns a bool.
         """
 
+        attributes = self._normalize_attribute_names(kwargs)
         if url is None:
-            yield from self._iter_cache_all(**kwargs)
+            yield from self._iter_cache_all(attributes)
         else:
-            yield from self._iter_cache_filtered(url, **kwargs)
+            yield from self._iter_cache_filtered(url, attributes)
 
 
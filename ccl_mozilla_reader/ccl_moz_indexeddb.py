@@ -21,6 +21,7 @@ SOFTWARE.
 """
 import collections.abc
 import dataclasses
+import functools
 import io
 import pathlib
 import sqlite3
@@ -53,12 +54,49 @@ class ObjectStoreMetadata:
     key_path: str
 
 
+class _DeferredValue:
+    # wraps the function which will decode a record's value, for passing as the value of a MozillaIndexedDbRecord
+    __slots__ = ("loader",)
+
+    def __init__(self, loader: collections.abc.Callable[[], typing.Any]):
+        self.loader = loader
+
+
+class _LazyRecordValue:
+    """
+    Descriptor for MozillaIndexedDbRecord.value. A value passed in as a _DeferredValue is only decoded the first time
+    that it's accessed (and then kept); any other value is stored and returned as-is.
+    """
+    def __set_name__(self, owner, name):
+        self._storage_name = f"_{name}"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            # tells dataclasses that the field has no default
+            raise AttributeError(self._storage_name[1:])
+        value = instance.__dict__[self._storage_name]
+        if type(value) is _DeferredValue:
+            value = value.loader()
+            instance.__dict__[self._storage_name] = value
+        return value
+
+    def __set__(self, instance, value):
+        # only reached from __init__; assignment afterwards is refused by the frozen dataclass
+        instance.__dict__[self._storage_name] = value
+
+
 @dataclasses.dataclass(frozen=True)
 class MozillaIndexedDbRecord:
+    """
+    A record from an object store. When read from a database, the value is only decompressed and deserialized when
+    it's first accessed (it's the expensive part of reading a record and often isn't needed), so any errors in doing
+    so are raised then, rather than while iterating the records. External values are read from their file at that
+    point too, so the file must still be available.
+    """
     owner: "MozillaIndexedDbDatabase"
     object_store_meta: ObjectStoreMetadata
     key: ccl_moz_indexeddb_key.MozillaIdbKey
-    value: typing.Any
+    value: typing.Any = _LazyRecordValue()
     file_ids: tuple[str, ...]
     external_value_path: typing.Optional[str] = None
 
@@ -109,6 +147,8 @@ class MozillaIndexedDbDatabase:
         FROM object_store;
     """
 
+    _RECORD_FETCH_BATCH_SIZE = 1024
+
     RECORD_BY_OBJECT_STORE_QUERY = """
         SELECT
             "object_data"."key",
@@ -165,48 +205,68 @@ class MozillaIndexedDbDatabase:
             raise TypeError(f"Unexpected type for object_store: {type(object_store)}")
 
         cur = self._db.cursor()
+        # rows are fetched in batches rather than one at a time, and the names used for every row are looked up once.
+        # Plain tuple rows (unpacked in the order of the query's columns) save a lookup by name for every field.
+        cur.row_factory = None
+        cur.arraysize = MozillaIndexedDbDatabase._RECORD_FETCH_BATCH_SIZE
         cur.execute(MozillaIndexedDbDatabase.RECORD_BY_OBJECT_STORE_QUERY, (object_store_meta.id_number,))
 
-        for row in cur:
-            key = ccl_moz_indexeddb_key.MozillaIdbKey.from_bytes(row["key"])
-            file_ids = (row["file_ids"] or "").split()
-            data_compressed = row["data"]
-            external_data_location = None
-            if isinstance(data_compressed, bytes):
-                with io.BytesIO(data_compressed) as d:
-                    data_decompressed = ccl_simplesnappy.decompress(d)
-                with io.BytesIO(data_decompressed) as d:
-                    value_reader = ccl_moz_structured_clone_reader.StructuredCloneReader(d)
-                    value = value_reader.read_root()
-            elif isinstance(data_compressed, int):
-                # externally held data, value is an int64 containing a 32-bit file index into file_ids and a flag in
-                # the 33rd bit indicating whether it's compressed
-                # see: /dom/indexedDB/ActorsParent.cpp ObjectStoreAddOrPutRequestOp::DoDatabaseWork
-                file_index = data_compressed & 0xffffffff
-                external_data_compressed = data_compressed & 0x100000000 != 0
-                if file_index >= len(file_ids):
-                    raise ValueError(f"External file index too large for record with key {key.raw_key.hex()}")
-                if not file_ids[file_index].startswith("."):
-                    raise ValueError(
-                        f"External record data file id does not start with '.' in record with key {key.raw_key.hex()}")
-                external_data_location = self._owner.get_external_data_file_details(
-                    self, file_ids[file_index].lstrip("."))
-                raw_external_data_stream = self._owner.get_external_data_stream(self, file_ids[file_index].lstrip("."))
-                if external_data_compressed:
-                    with io.BytesIO() as external_data_decompressed:
-                        ccl_simplesnappy.decompress_framed(
-                            raw_external_data_stream, external_data_decompressed, mozilla_mode=True)
-                        external_data_decompressed.seek(0)
-                        value_reader = ccl_moz_structured_clone_reader.StructuredCloneReader(external_data_decompressed)
-                        value = value_reader.read_root()
+        key_from_bytes = self._owner.get_key
+        read_inline_value = MozillaIndexedDbDatabase._read_inline_value
+        record_type = MozillaIndexedDbRecord
+
+        while batch := cur.fetchmany():
+            for raw_key, data_compressed, raw_file_ids in batch:
+                key = key_from_bytes(raw_key)
+                file_ids = (raw_file_ids or "").split()
+                external_data_location = None
+                if isinstance(data_compressed, bytes):
+                    value_loader = functools.partial(read_inline_value, data_compressed)
+                elif isinstance(data_compressed, int):
+                    # externally held data, value is an int64 containing a 32-bit file index into file_ids and a flag
+                    # in the 33rd bit indicating whether it's compressed
+                    # see: /dom/indexedDB/ActorsParent.cpp ObjectStoreAddOrPutRequestOp::DoDatabaseWork
+                    file_index = data_compressed & 0xffffffff
+                    external_data_compressed = data_compressed & 0x100000000 != 0
+                    if file_index >= len(file_ids):
+                        raise ValueError(f"External file index too large for record with key {key.raw_key.hex()}")
+                    if not file_ids[file_index].startswith("."):
+                        raise ValueError(
+                            f"External record data file id does not start with '.' in record with key "
+                            f"{key.raw_key.hex()}")
+                    external_data_location = self._owner.get_external_data_file_details(
+                        self, file_ids[file_index].lstrip("."))
+                    value_loader = functools.partial(
+                        self._read_external_value, file_ids[file_index].lstrip("."), external_data_compressed)
                 else:
-                    value_reader = ccl_moz_structured_clone_reader.StructuredCloneReader(raw_external_data_stream)
-                    value = value_reader.read_root()
+                    raise ValueError(
+                        f"Unexpected type for record data ({type(data_compressed)}) in record with key "
+                        f"{key.raw_key.hex()}")
 
-            yield MozillaIndexedDbRecord(self, object_store_meta, key, value, tuple(file_ids), external_data_location)
+                yield record_type(
+                    self, object_store_meta, key, _DeferredValue(value_loader), tuple(file_ids), external_data_location)
 
         cur.close()
 
+    @staticmethod
+    def _read_inline_value(data_compressed: bytes) -> typing.Any:
+        # closing a BytesIO does nothing for us, so no need for the context managers here
+        data_decompressed = ccl_simplesnappy.decompress(io.BytesIO(data_compressed))
+        return ccl_moz_structured_clone_reader.StructuredCloneReader(io.BytesIO(data_decompressed)).read_root()
+
+    def _read_external_value(self, file_id: str, is_compressed: bool) -> typing.Any:
+        with self._owner.get_external_data_stream(self, file_id) as raw_external_data_stream:
+            if is_compressed:
+                with io.BytesIO() as external_data_decompressed:
+                    ccl_simplesnappy.decompress_framed(
+                        raw_external_data_stream, external_data_decompressed, mozilla_mode=True)
+                    external_data_decompressed.seek(0)
+                    value_reader = ccl_moz_structured_clone_reader.StructuredCloneReader(external_data_decompressed)
+                    return value_reader.read_root()
+            else:
+                value_reader = ccl_moz_structured_clone_reader.StructuredCloneReader(raw_external_data_stream)
+                return value_reader.read_root()
+
     @property
     def owner(self):
         return self._owner
@@ -261,8 +321,14 @@ class MozillaIndexedDb:
     This class represents a whole "idb" folder, brokers access to each database and external files
     """
 
+    # Decoded keys are only ever asked for again when a store's records are read more than once, so the cache is kept
+    # small and belongs to this object (and is emptied when it is closed) rather than living for the whole process.
+    _KEY_CACHE_SIZE = 1024
+
     def __init__(self, idb_folder_path: pathlib.Path):
         self._path = idb_folder_path
+        self._get_key_cached = functools.lru_cache(maxsize=MozillaIndexedDb._KEY_CACHE_SIZE)(
+            ccl_moz_indexeddb_key.MozillaIdbKey.from_bytes)
         self._databases = [
             MozillaIndexedDbDatabase(db_path, self) for db_path in self._path.glob("*.sqlite")
         ]
@@ -290,6 +356,14 @@ class MozillaIndexedDb:
         if ext_id in self._external_file_lookup[database.db_path]:
             return self._external_file_lookup[database.db_path][ext_id]
 
+    def get_key(self, raw_key: bytes) -> ccl_moz_indexeddb_key.MozillaIdbKey:
+        """
+        Decodes a raw key from one of the databases, reusing the key if it has been decoded recently
+
+        :param raw_key: the key as stored in the database
+        """
+        return self._get_key_cached(bytes(raw_key))
+
     @property
     def databases(self):
         yield from self._databases
@@ -301,6 +375,7 @@ class MozillaIndexedDb:
     def close(self):
         for db in self._databases:
             db.close()
+        self._get_key_cached.cache_clear()
 
     def __enter__(self) -> "MozillaIndexedDb":
         return self
@@ -20,9 +20,11 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import array
 import datetime
-import io
+import re
 import struct
+import sys
 import typing
 
 __version__ = "0.1"
@@ -41,6 +43,23 @@ TOKEN_Binary = 0x40
 TOKEN_Array = 0x50
 
 
+# see: Key::kMaxArrayCollapse
+_MAX_ARRAY_COLLAPSE = 3
+
+_UINT64 = struct.Struct(">Q")
+_DOUBLE = struct.Struct(">d")
+_SIGN_BIT = 0x8000000000000000
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# 1 byte characters in string keys are stored as the codepoint + 1
+_ONE_BYTE_CHAR_DECODE = bytes.maketrans(bytes(range(0x01, 0x80)), bytes(range(0x00, 0x7f)))
+
+# the UTF-16 code units of decoded string keys are built in native byte order before being decoded in one go
+_UTF16_NATIVE = "utf-16-le" if sys.byteorder == "little" else "utf-16-be"
+_ONE_BYTE_RUN_END = re.compile(rb"[\x00\x80-\xff]")
+
+
 class EndOfTokens(Exception):
     pass
 
@@ -52,101 +71,133 @@ class TerminatorEncountered(Exception):
 class _IdbKeyReader:
     def __init__(self, data: bytes):
         self._raw = data
-        self._f = io.BytesIO(data)
+        self._pos = 0
 
     def _read_until_nul(self):
-        buffer = []
-        while True:
-            b = self._f.read(1)
-            if not b or b == b"\x00":
-                break
-            buffer.append(b[0])
-        return bytes(buffer)
+        end = self._raw.find(b"\x00", self._pos)
+        if end == -1:
+            # runs to the end of the key
+            result = self._raw[self._pos:]
+            self._pos = len(self._raw)
+        else:
+            result = self._raw[self._pos:end]
+            self._pos = end + 1
+        return result
 
     def _read_float(self):
         # trailing 00 bytes in a key are truncated, so we have to add them back in if needed
-        number_raw = bytearray(self._f.read(8))
-        shortage = 8 - len(number_raw)
-        number_raw = number_raw + (b"\x00" * shortage)
-        # floats are stored weirdly, so that they sort correctly
-        if number_raw[0] & 0x80 != 0:
-            # a positive number
-            number_raw[0] = number_raw[0] & 0x7f
-            return struct.unpack(">d", number_raw)[0]
+        number_raw = self._raw[self._pos:self._pos + 8]
+        self._pos += len(number_raw)
+        number, = _UINT64.unpack(number_raw.ljust(8, b"\x00"))
+        # floats are stored weirdly, so that they sort correctly: positive numbers have the sign bit set, negative
+        # numbers are negated as an unsigned 64-bit integer. See: Key::DecodeNumber
+        if number & _SIGN_BIT:
+            bits = number & ~_SIGN_BIT
         else:
-            return -struct.unpack(">d", number_raw)[0]
+            bits = -number & 0xffffffffffffffff
+        return _DOUBLE.unpack(_UINT64.pack(bits))[0]
 
     def _read_string(self, is_binary=False):
+        start = self._pos
         data = self._read_until_nul()
-        i = 0
-        chars = []
-        while i < len(data):
-            byte_1 = data[i]
+        if data.isascii():
+            # only 1 byte characters (the usual case), so the whole thing can be shifted back down in one go
+            data = data.translate(_ONE_BYTE_CHAR_DECODE)
+            return data if is_binary else data.decode("ascii")
+
+        # the trailing bytes of 2 and 3 byte characters can be 00, so the terminator can only be found by walking the
+        # characters (see: Key::CalcDecodedStringySize). Trailing 00s are also truncated from the end of a key, so pad
+        # them back in, which also provides a terminator if the key ends mid-string.
+        raw = self._raw + b"\x00\x00\x00"
+        raw_length = len(self._raw)
+
+        # decode into an array of UTF-16 code units (or byte values for binary) first, then build the result with a
+        # single decode rather than a character at a time. Key.cpp decodes strings into char16_t, so non-BMP
+        # characters are stored as surrogate pairs which the utf-16 decode recombines; unpaired surrogates are legal
+        # in JS strings, hence "surrogatepass".
+        code_units = array.array("B" if is_binary else "H")
+        append = code_units.append
+        i = start
+        while True:
+            byte_1 = raw[i]
             i += 1
 
-            if byte_1 & 0b10000000 == 0:
-                # 1 byte character, stored as codepoint + 1
-                if is_binary:
-                    chars.append(byte_1 - 1)
-                else:
-                    chars.append(chr(byte_1 - 1))
+            if byte_1 == TOKEN_Terminator:
+                break
+            elif byte_1 & 0b10000000 == 0:
+                # 1 byte character, stored as codepoint + 1; take the whole run of them at once
+                run_end = _ONE_BYTE_RUN_END.search(raw, i).start()
+                code_units.extend(raw[i - 1:run_end].translate(_ONE_BYTE_CHAR_DECODE))
+                i = run_end
             elif byte_1 & 0b11000000 == 0b10000000:
-                # 2 byte character encoded as 10xxxxxx xxxxxxxx with 7F subtracted
-                byte_2 = data[i]
+                # 2 byte character encoded as 10xxxxxx xxxxxxxx with TWO_BYTE_ADJUST (-0x7F) applied, so add it back
+                append((((byte_1 & 0b00111111) << 8) | raw[i]) + 0x7f)
                 i += 1
-                value = (((byte_1 & 0b00111111) << 8) | byte_2) - 0x7f
-                if is_binary:
-                    chars.append(value)
-                else:
-                    chars.append(chr(value))
-            elif byte_1 & 0b11000000 == 0b11000000:
+            else:
                 # 3 byte character encoded as 11xxxxxx xxxxxxxx xx000000
-                byte_2 = data[i]
-                i += 1
-                byte_3 = data[i]
-                i += 1
-
-                value = (byte_1 & 0b00111111) << 16
-                value |= byte_2 << 8
-                value |= byte_3 & 0b11000000
-                value >>= 6
+                append((((byte_1 & 0b00111111) << 16) | (raw[i] << 8) | (raw[i + 1] & 0b11000000)) >> 6)
+                i += 2
 
-                if is_binary:
-                    chars.append(value)
-                else:
-                    chars.append(chr(value))
+        self._pos = min(i, raw_length)
         if is_binary:
-            return bytes(chars)
+            return code_units.tobytes()
         else:
-            return "".join(chars)
-
-    def _read_token(self, token) -> typing.Union[str, bytes, float, datetime.datetime, tuple]:
-        if token == TOKEN_Terminator:
-            raise TerminatorEncountered()
-        elif token == TOKEN_Float:
-            return self._read_float()
-        elif token == TOKEN_Date:
-            return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=self._read_float())
-        elif token == TOKEN_String:
-            return self._read_string()
-        elif token >= TOKEN_Array:
-            result = []
-            next_token = token - TOKEN_Array
-            if next_token > TOKEN_Terminator:
-                result.append(self._read_token(next_token))
-
-            while True:
-                try:
-                    result.append(self.read())
-                except (EndOfTokens, TerminatorEncountered):
-                    return tuple(result)
+            return code_units.tobytes().decode(_UTF16_NATIVE, "surrogatepass")
+
+    def _read_terminator(self):
+        raise TerminatorEncountered()
+
+    def _read_date(self):
+        return _EPOCH + datetime.timedelta(milliseconds=self._read_float())
+
+    def _read_binary(self):
+        return self._read_string(is_binary=True)
+
+    # token type to the function which reads its value
+    _TOKEN_READERS = {
+        TOKEN_Terminator: _read_terminator,
+        TOKEN_Float: _read_float,
+        TOKEN_Date: _read_date,
+        TOKEN_String: _read_string,
+        TOKEN_Binary: _read_binary,
+    }
+
+    def _read_token(self, token) -> typing.Union[str, bytes, float, datetime.datetime, None]:
+        reader = _IdbKeyReader._TOKEN_READERS.get(token)
+        if reader is not None:
+            return reader(self)
 
     def read(self) -> typing.Union[str, bytes, float, datetime.datetime, tuple]:
-        token_raw = self._f.read(1)
-        if not token_raw:
-            raise EndOfTokens()
-        token = token_raw[0]
-        return self._read_token(token)
+        # Arrays are decoded with an explicit stack rather than recursion. As per Key::DecodeJSValInternal, the type
+        # of an array's first element (or the terminator of an empty array) shares a byte with the array token(s) by
+        # way of an offset, up to kMaxArrayCollapse levels deep.
+        raw = self._raw
+        arrays = []
+        type_offset = 0
+        while True:
+            if arrays and (self._pos >= len(raw) or raw[self._pos] - type_offset == TOKEN_Terminator):
+                # end of the current array
+                self._pos += 1
+                value = tuple(arrays.pop())
+            else:
+                if self._pos >= len(raw):
+                    raise EndOfTokens()
+                token = raw[self._pos] - type_offset
+                if token >= TOKEN_Array:
+                    # the token byte isn't consumed here as it may also carry the first element's type
+                    type_offset += TOKEN_Array
+                    if type_offset == TOKEN_Array * _MAX_ARRAY_COLLAPSE:
+                        self._pos += 1
+                        type_offset = 0
+                    arrays.append([])
+                    continue
+                self._pos += 1
+                value = self._read_token(token)
+
+            type_offset = 0
+            if not arrays:
+                return value
+            arrays[-1].append(value)
 
 
 class MozillaIdbKey:
@@ -156,10 +207,7 @@ class MozillaIdbKey:
 
     @classmethod
     def from_bytes(cls, raw_key: bytes):
-        r = _IdbKeyReader(raw_key)
-        value = r.read()
-
-        return cls(value, raw_key)
+        return cls(_IdbKeyReader(raw_key).read(), raw_key)
 
     def __eq__(self, other):
         if isinstance(other, MozillaIdbKey):
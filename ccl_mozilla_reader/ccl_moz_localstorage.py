@@ -20,7 +20,10 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import codecs
+import concurrent.futures
 import enum
+import functools
 import io
 import pathlib
 import re
@@ -33,7 +36,7 @@ import typing
 
 import ccl_simplesnappy
 from .storage_common import MetadataV2
-from .common import KeySearch, is_keysearch_hit
+from .common import KeySearch, make_keysearch_predicate, make_pattern_predicate
 
 
 __version__ = "0.1.1"
@@ -41,6 +44,21 @@ __description__ = "Library for reading Mozilla Firefox local storage"
 __contact__ = "Alex Caithness"
 
 
+# cramjam is optional, but when installed its (compiled) snappy implementation is used for compressed values
+try:
+    import cramjam
+except ImportError:
+    cramjam = None
+
+
+def _snappy_decompress(data: bytes) -> bytes:
+    # localstorage values use raw (unframed) snappy
+    if cramjam is not None:
+        return bytes(cramjam.snappy.decompress_raw(data))
+    with io.BytesIO(data) as data_stream:
+        return ccl_simplesnappy.decompress(data_stream)
+
+
 class ConversionType(enum.IntEnum):
     # localstorage/LSValue.h
     utf_16 = 0  # called "NONE" in the original enum, but I wanted to make explicit what the default actually was
@@ -77,7 +95,7 @@ class LocalStoreDb:
     module, and to make searching filtering easier for the user of the class.
     """
 
-    LS_QUERY = """
+    _LS_QUERY_BASE = """
         SELECT
             rowid, 
             "data"."key",
@@ -86,7 +104,21 @@ class LocalStoreDb:
             "data"."compression_type",
             "data"."last_access_time",
             "data"."value"
-        FROM "data";"""
+        FROM "data" """
+
+    LS_QUERY = _LS_QUERY_BASE + ";"
+
+    _WHERE_KEY_EQUALS_PREDICATE = """"data"."key" = ?"""
+
+    _WHERE_KEY_IN_PREDICATE = """"data"."key" IN ({parameter_question_marks})"""
+
+    _WHERE_KEY_REGEX_PREDICATE = """"data"."key" REGEXP ?"""
+
+    # metadata files read at once when collecting the origins
+    _METADATA_READ_WORKERS = 8
+
+    # above this, collections of keys are filtered in Python rather than risk SQLite's limit on parameters
+    _MAX_KEY_IN_PARAMETERS = 500
 
     def __init__(self, path: pathlib.Path):
         """
@@ -95,16 +127,19 @@ class LocalStoreDb:
         """
         if not path.is_dir():
             raise ValueError(f"path does not exist or is not a directory")
-        self._host_lookup= {}  # origin to database path
-        self._metadata_lookup = {}  # origin to metadatav2
-        self._collect_hosts(path)
-        self._host_lookup = types.MappingProxyType(self._host_lookup)
-        self._metadata_lookup = types.MappingProxyType(self._metadata_lookup)
+        # finding the databases is cheap, but reading the metadata (to get the origins) is deferred until the origins
+        # are actually needed; see _lookups
+        self._database_paths = self._collect_database_paths(path)  # [(.metadata-v2 path, database path), ...]
+
+        # the hosts don't change once collected, so the hosts matching a given pattern can be remembered
+        self._pattern_hits_cache: dict[re.Pattern, tuple[str, ...]] = {}
 
         # we lazy load the databases
-        self._databases: dict[str, typing.Optional[sqlite3.Connection]] = {x: None for x in self._host_lookup.keys()}
+        self._databases: dict[str, sqlite3.Connection] = {}
 
-    def _collect_hosts(self, storage_default_folder: pathlib.Path):
+    @staticmethod
+    def _collect_database_paths(storage_default_folder: pathlib.Path) -> list[tuple[pathlib.Path, pathlib.Path]]:
+        database_paths = []
         for domain_folder in storage_default_folder.iterdir():
             if not domain_folder.is_dir():
                 continue
@@ -116,18 +151,43 @@ class LocalStoreDb:
             if not metadata_path.is_file():
                 raise ValueError(f".metadata-v2 file missing from {domain_folder}")
 
-            metadata = MetadataV2.from_file(metadata_path)
-            self._host_lookup[metadata.origin] = ls_db
-            self._metadata_lookup[metadata.origin] = metadata
+            database_paths.append((metadata_path, ls_db))
+
+        return database_paths
+
+    @functools.cached_property
+    def _lookups(self) -> tuple[types.MappingProxyType, types.MappingProxyType]:
+        # each metadata file is small, so this is dominated by the latency of opening the files which can be overlapped
+        metadata_paths = [metadata_path for metadata_path, _ in self._database_paths]
+        with concurrent.futures.ThreadPoolExecutor(LocalStoreDb._METADATA_READ_WORKERS) as executor:
+            metadatas = list(executor.map(MetadataV2.from_file, metadata_paths))
+
+        host_lookup = {}  # origin to database path
+        metadata_lookup = {}  # origin to metadatav2
+        for metadata, (_, ls_db) in zip(metadatas, self._database_paths):
+            host_lookup[metadata.origin] = ls_db
+            metadata_lookup[metadata.origin] = metadata
+
+        return types.MappingProxyType(host_lookup), types.MappingProxyType(metadata_lookup)
+
+    @property
+    def _host_lookup(self) -> types.MappingProxyType:
+        return self._lookups[0]
+
+    @property
+    def _metadata_lookup(self) -> types.MappingProxyType:
+        return self._lookups[1]
 
     def _lazy_load_database(self, storage_key: str):
-        if storage_key not in self._databases:
+        if storage_key not in self._host_lookup:
             raise KeyError(storage_key)
 
-        if self._databases[storage_key] is None:
+        if storage_key not in self._databases:
             self._databases[storage_key] = sqlite3.connect(
                 self._host_lookup[storage_key].absolute().as_uri() + "?mode=ro", uri=True)
-            self._databases[storage_key].row_factory = sqlite3.Row
+            self._databases[storage_key].create_function(
+                "regexp", 2, lambda y, x: 1 if x is not None and re.search(y, x) is not None else 0,
+                deterministic=True)
 
     def iter_storage_keys(self) -> col_abc.Iterable[str]:
         yield from self._host_lookup.keys()
@@ -150,7 +210,10 @@ class LocalStoreDb:
                 yielded = True
                 yield from hits
         elif isinstance(storage_key, re.Pattern):
-            hits = [h for h in self._host_lookup.keys() if storage_key.search(h) is not None]
+            hits = self._pattern_hits_cache.get(storage_key)
+            if hits is None:
+                hits = tuple(filter(make_pattern_predicate(storage_key), self._host_lookup.keys()))
+                self._pattern_hits_cache[storage_key] = hits
             if hits:
                 yielded = True
                 yield from hits
@@ -166,13 +229,14 @@ class LocalStoreDb:
             raise KeyError(storage_key)
 
     @staticmethod
-    def _record_from_row(database_path: pathlib.Path, storage_key, row: sqlite3.Row) -> LocalStorageRecord:
-        conv_type = ConversionType(row["conversion_type"])
-        compr_type = CompressionType(row["compression_type"])
-        value_raw = row["value"]
+    def _record_from_row(database_path: pathlib.Path, storage_key, row: tuple) -> LocalStorageRecord:
+        # plain tuples in the column order of _LS_QUERY_BASE
+        rowid, script_key, _, conversion_type, compression_type, _, value_raw = row
+        conv_type = ConversionType(conversion_type)
+        compr_type = CompressionType(compression_type)
+        value_stored = value_raw
         if compr_type == CompressionType.snappy:
-            with io.BytesIO(value_raw) as value_raw_stream:
-                value_raw = ccl_simplesnappy.decompress(value_raw_stream)
+            value_raw = _snappy_decompress(value_raw)
         elif compr_type == CompressionType.uncompressed:
             pass
         else:
@@ -181,7 +245,8 @@ class LocalStoreDb:
         if not value_raw:
             value = value_raw  # empty values are bound to a string due to column type, which doesn't have a decode func
         elif conv_type == ConversionType.utf_16:
-            value = value_raw.decode("utf-16-be")
+            # calling the codec function directly skips the codec lookup that bytes.decode does on every call
+            value, _ = codecs.utf_16_be_decode(value_raw, "strict", True)
         elif conv_type == ConversionType.utf_8:
             value = value_raw.decode("utf-8")
         else:
@@ -189,15 +254,50 @@ class LocalStoreDb:
 
         return LocalStorageRecord(
             storage_key,
-            row["key"],
+            script_key,
             value,
             database_path,
-            row["rowid"],
-            row["value"],
+            rowid,
+            value_stored,
             conv_type,
             compr_type
         )
 
+    @staticmethod
+    def _make_query_for_script_key(
+            script_key: typing.Optional[KeySearch]
+    ) -> tuple[str, tuple, typing.Optional[col_abc.Callable[[str], bool]]]:
+        """
+        Where possible the filtering on script_key is done by SQLite so that rows which don't match (and their,
+        potentially large, values) never make it back to Python.
+
+        :return: the query, its parameters, and a predicate for any filtering still needed on the rows (or None)
+        """
+        predicate = None
+        parameters = ()
+        if script_key is None:
+            pass
+        elif isinstance(script_key, str):
+            predicate = LocalStoreDb._WHERE_KEY_EQUALS_PREDICATE
+            parameters = (script_key,)
+        elif isinstance(script_key, re.Pattern):
+            # the REGEXP function only gets the pattern's string, so patterns compiled with flags are tested here
+            if script_key.flags == re.compile(script_key.pattern).flags:
+                predicate = LocalStoreDb._WHERE_KEY_REGEX_PREDICATE
+                parameters = (script_key.pattern,)
+        elif isinstance(script_key, col_abc.Collection):
+            parameters = tuple(set(script_key))
+            if len(parameters) <= LocalStoreDb._MAX_KEY_IN_PARAMETERS:
+                predicate = LocalStoreDb._WHERE_KEY_IN_PREDICATE.format(
+                    parameter_question_marks=",".join("?" for _ in parameters))
+            else:
+                parameters = ()
+
+        if predicate is None:
+            row_predicate = None if script_key is None else make_keysearch_predicate(script_key)
+            return LocalStoreDb.LS_QUERY, (), row_predicate
+        return f"{LocalStoreDb._LS_QUERY_BASE} WHERE {predicate};", parameters, None
+
     def iter_records(
             self, storage_key: typing.Optional[KeySearch], script_key: typing.Optional[KeySearch], *,
             raise_on_no_result=True) -> col_abc.Iterable[LocalStorageRecord]:
@@ -206,13 +306,15 @@ class LocalStoreDb:
         if not hosts and raise_on_no_result:
             raise KeyError(storage_key)
 
+        query, parameters, script_key_hit = LocalStoreDb._make_query_for_script_key(script_key)
+
         yielded = False
         for host in hosts:
             self._lazy_load_database(host)
             cur = self._databases[host].cursor()
-            cur.execute(LocalStoreDb.LS_QUERY)
+            cur.execute(query, parameters)
             for row in cur:
-                if script_key is None or is_keysearch_hit(script_key, row["key"]):
+                if script_key_hit is None or script_key_hit(row[1]):  # "key" column
                     rec = LocalStoreDb._record_from_row(self._host_lookup[host], host, row)
                     yield rec
                     yielded = True
@@ -228,8 +330,7 @@ class LocalStoreDb:
 
     def close(self):
         for database in self._databases.values():
-            if database is not None:
-                database.close()
+            database.close()
 
     def __enter__(self) -> "LocalStoreDb":
         return self
@@ -66,6 +66,16 @@ class VisitType(enum.IntEnum):
     reload = 9
 
 
+# indexed by value; cheaper than going through the enum's own lookup for every row
+_VISIT_TYPE_LOOKUP = (None, *sorted(VisitType))
+
+
+def _lookup_visit_type(value: int) -> VisitType:
+    if 0 < value < len(_VISIT_TYPE_LOOKUP):
+        return _VISIT_TYPE_LOOKUP[value]
+    return VisitType(value)  # will raise for an unknown value
+
+
 class DownloadState(enum.IntEnum):
     # toolkit/components/downloads/DownloadHistory.sys.mjs
     unknown = 0
@@ -148,7 +158,12 @@ class MozillaPlacesDatabase:
 
     _WHERE_URL_EQUALS_PREDICATE = """"moz_places"."url" = ?"""
 
-    _WHERE_URL_REGEX_PREDICATE = """"moz_places"."url" REGEXP ?"""
+    _WHERE_PLACE_ID_IN_PREDICATE = """"moz_places"."id" IN ({parameter_question_marks})"""
+
+    _PLACE_URLS_QUERY = """SELECT "moz_places"."id", "moz_places"."url" FROM "moz_places";"""
+
+    # keeps the number of parameters in a query well within SQLite's limit
+    _PLACE_ID_BATCH_SIZE = 500
 
     _WHERE_URL_IN_PREDICATE = """"moz_places"."url" IN ({parameter_question_marks})"""
 
@@ -162,6 +177,31 @@ class MozillaPlacesDatabase:
 
     _WHERE_VISIT_IS_DOWNLOAD_PREDICATE = f""""moz_historyvisits"."visit_type" = {VisitType.download.value}"""
 
+    _HISTORY_BY_VISIT_ID_QUERY = f"{_HISTORY_QUERY} WHERE {_WHERE_VISIT_ID_EQUALS_PREDICATE};"
+
+    _HISTORY_BY_FROM_VISIT_QUERY = f"{_HISTORY_QUERY} WHERE {_WHERE_FROM_VISIT_EQUALS_PREDICATE};"
+
+    _HISTORY_DOWNLOADS_QUERY = f"{_HISTORY_QUERY} WHERE {_WHERE_VISIT_IS_DOWNLOAD_PREDICATE};"
+
+    _HISTORY_TREE_QUERY = f"""
+    WITH RECURSIVE "tree"("id") AS (
+        VALUES {{root_values}}
+        UNION
+        SELECT "moz_historyvisits"."id"
+        FROM "moz_historyvisits"
+        INNER JOIN "tree" ON "moz_historyvisits"."from_visit" = "tree"."id"
+    )
+    {_HISTORY_QUERY}
+    WHERE "moz_historyvisits"."id" IN (SELECT "id" FROM "tree")
+    ORDER BY "moz_historyvisits"."id";"""
+
+    # the database is opened read-only, so these just let SQLite make more use of memory when reading
+    _CONNECTION_PRAGMAS = (
+        "PRAGMA cache_size = -65536;",
+        "PRAGMA mmap_size = 268435456;",
+        "PRAGMA temp_store = MEMORY;",
+    )
+
     _DOWNLOAD_ATTRIBUTES_QUERY = """
         SELECT 
           "moz_anno_attributes"."name",
@@ -177,62 +217,118 @@ class MozillaPlacesDatabase:
     _DOWNLOAD_METADATA_KEY = "downloads/metaData"
 
     def __init__(self, places_db_path: pathlib.Path):
+        # rows come back as plain tuples (in the column order of _HISTORY_QUERY) which are unpacked positionally,
+        # only iter_history_rows_raw hands out sqlite3.Row objects
         self._conn = sqlite3.connect(places_db_path.absolute().as_uri() + "?mode=ro", uri=True)
-        self._conn.row_factory = sqlite3.Row
-        self._conn.create_function("regexp", 2, lambda y, x: 1 if re.search(y, x) is not None else 0)
-
-    def _row_to_record(self, row: sqlite3.Row) -> MozillaHistoryRecord:
+        for pragma in MozillaPlacesDatabase._CONNECTION_PRAGMAS:
+            self._conn.execute(pragma)
+        # single row lookups (which are fully consumed before returning) can share a cursor; anything that yields
+        # rows lazily still needs its own
+        self._lookup_cur = self._conn.cursor()
+        # populated by prefetch_tree
+        self._prefetched_records: dict[int, MozillaHistoryRecord] = {}
+        self._prefetched_children: dict[int, list[int]] = {}
+
+    def _row_to_record(self, row: tuple) -> MozillaHistoryRecord:
+        visit_id, url, title, _, _, visit_date, visit_type, from_visit = row
         return MozillaHistoryRecord(
             self,
-            row["id"],
-            row["url"],
-            row["title"],
-            parse_unix_microseconds(row["visit_date"]),
-            VisitType(row["visit_type"]),
-            row["from_visit"]
+            visit_id,
+            url,
+            title,
+            parse_unix_microseconds(visit_date),
+            _lookup_visit_type(visit_type),
+            from_visit
         )
 
     def get_parent_of(self, record: MozillaHistoryRecord) -> typing.Optional[MozillaHistoryRecord]:
         if record.from_visit_id == 0:
             return None
 
-        query = MozillaPlacesDatabase._HISTORY_QUERY
-        query += f" WHERE {MozillaPlacesDatabase._WHERE_VISIT_ID_EQUALS_PREDICATE};"
-        cur = self._conn.cursor()
-        cur.execute(query, (record.from_visit_id,))
-        row = cur.fetchone()
-        cur.close()
-        if row:
-            return self._row_to_record(row)
+        if record.from_visit_id in self._prefetched_records:
+            return self._prefetched_records[record.from_visit_id]
+        return self.get_record_with_id(record.from_visit_id)
 
     def get_children_of(self, record: MozillaHistoryRecord) -> col_abc.Iterable[MozillaHistoryRecord]:
-        query = MozillaPlacesDatabase._HISTORY_QUERY
-        predicate = MozillaPlacesDatabase._WHERE_FROM_VISIT_EQUALS_PREDICATE
-        query += f" WHERE {predicate};"
+        if record.rec_id in self._prefetched_children:
+            for child_id in self._prefetched_children[record.rec_id]:
+                yield self._prefetched_records[child_id]
+            return
+
         cur = self._conn.cursor()
-        cur.execute(query, (record.rec_id,))
+        cur.execute(MozillaPlacesDatabase._HISTORY_BY_FROM_VISIT_QUERY, (record.rec_id,))
         for row in cur:
             yield self._row_to_record(row)
 
         cur.close()
 
-    def get_record_with_id(self, visit_id: int) -> typing.Optional[MozillaHistoryRecord]:
-        query = MozillaPlacesDatabase._HISTORY_QUERY
-        query += f" WHERE {MozillaPlacesDatabase._WHERE_VISIT_ID_EQUALS_PREDICATE};"
+    def prefetch_tree(self, roots: col_abc.Iterable[typing.Union[MozillaHistoryRecord, int]]) -> None:
+        """
+        Loads the visits in the trees starting at roots (i.e., the roots and all of their descendants, following the
+        from_visit field) in one go, so that subsequent calls to get_parent_of and get_children_of for records in
+        those trees don't need to go back to the database.
+
+        :param roots: the records (or visit ids) at the top of the trees to prefetch
+        """
+        root_ids = [root.rec_id if isinstance(root, MozillaHistoryRecord) else root for root in roots]
+        batch_size = MozillaPlacesDatabase._PLACE_ID_BATCH_SIZE
         cur = self._conn.cursor()
-        cur.execute(query, (visit_id,))
-        row = cur.fetchone()
+        for i in range(0, len(root_ids), batch_size):
+            batch = root_ids[i:i + batch_size]
+            query = MozillaPlacesDatabase._HISTORY_TREE_QUERY.format(root_values=",".join("(?)" for _ in batch))
+            records = [self._row_to_record(row) for row in cur.execute(query, batch)]
+
+            # every descendant of a root is in the tree, so the children of every record in it are known
+            children = {record.rec_id: [] for record in records}
+            for record in records:
+                self._prefetched_records[record.rec_id] = record
+                if record.from_visit_id in children:
+                    children[record.from_visit_id].append(record.rec_id)
+            self._prefetched_children.update(children)
+
         cur.close()
+
+    def get_record_with_id(self, visit_id: int) -> typing.Optional[MozillaHistoryRecord]:
+        row = self._lookup_cur.execute(MozillaPlacesDatabase._HISTORY_BY_VISIT_ID_QUERY, (visit_id,)).fetchone()
         if row:
             return self._row_to_record(row)
 
+    def _get_place_id_batches_matching(self, pattern: re.Pattern) -> list[list[int]]:
+        cur = self._conn.cursor()
+        place_ids = [place_id for place_id, url in cur.execute(MozillaPlacesDatabase._PLACE_URLS_QUERY)
+                     if url is not None and pattern.search(url)]
+        cur.close()
+
+        batch_size = MozillaPlacesDatabase._PLACE_ID_BATCH_SIZE
+        return [place_ids[i:i + batch_size] for i in range(0, len(place_ids), batch_size)]
+
     def iter_history_records(
             self, url: typing.Optional[KeySearch], *,
             earliest: typing.Optional[datetime.datetime]=None, latest: typing.Optional[datetime.datetime]=None
     ) -> col_abc.Iterable[MozillaHistoryRecord]:
+        for row in self._iter_history_rows(url, earliest, latest, None):
+            yield self._row_to_record(row)
+
+    def iter_history_rows_raw(
+            self, url: typing.Optional[KeySearch], *,
+            earliest: typing.Optional[datetime.datetime]=None, latest: typing.Optional[datetime.datetime]=None
+    ) -> col_abc.Iterable[sqlite3.Row]:
+        """
+        As per iter_history_records, but yields the sqlite3.Row objects straight from the history query without
+        building record objects, for when only some of the columns are needed (e.g. just the url). The visit_date
+        column is the raw timestamp (microseconds since the unix epoch; see parse_unix_microseconds).
+        """
+        yield from self._iter_history_rows(url, earliest, latest, sqlite3.Row)
+
+    def _iter_history_rows(
+            self, url: typing.Optional[KeySearch],
+            earliest: typing.Optional[datetime.datetime], latest: typing.Optional[datetime.datetime],
+            row_factory: typing.Optional[col_abc.Callable]
+    ) -> col_abc.Iterable[typing.Union[tuple, sqlite3.Row]]:
 
         predicates = []
         parameters = []
+        place_id_batches = None
 
         if url is None:
             pass  # no predicate
@@ -240,8 +336,11 @@ class MozillaPlacesDatabase:
             predicates.append(MozillaPlacesDatabase._WHERE_URL_EQUALS_PREDICATE)
             parameters.append(url)
         elif isinstance(url, re.Pattern):
-            predicates.append(MozillaPlacesDatabase._WHERE_URL_REGEX_PREDICATE)
-            parameters.append(url.pattern)
+            # Rather than have SQLite call back into Python for every row, test each distinct URL here and then
+            # query by the ids of the places which match.
+            place_id_batches = self._get_place_id_batches_matching(url)
+            if not place_id_batches:
+                return
         elif isinstance(url, col_abc.Collection):
             predicates.append(
                 MozillaPlacesDatabase._WHERE_URL_IN_PREDICATE.format(
@@ -260,41 +359,54 @@ class MozillaPlacesDatabase:
             predicates.append(MozillaPlacesDatabase._WHERE_VISIT_TIME_LATEST_PREDICATE)
             parameters.append(encode_unix_microseconds(latest))
 
-        query = MozillaPlacesDatabase._HISTORY_QUERY
-        if predicates:
-            query += f" WHERE {' AND '.join(predicates)}"
+        if place_id_batches is None:
+            query = MozillaPlacesDatabase._HISTORY_QUERY
+            if predicates:
+                query += f" WHERE {' AND '.join(predicates)}"
 
-        query += ";"
-        cur = self._conn.cursor()
-        for row in cur.execute(query, parameters):
-            if not isinstance(url, col_abc.Callable) or url(row["url"]):
-                yield self._row_to_record(row)
+            query += ";"
+            cur = self._conn.cursor()
+            cur.row_factory = row_factory
+            for row in cur.execute(query, parameters):
+                if not isinstance(url, col_abc.Callable) or url(row[1]):  # "url" column
+                    yield row
 
-        cur.close()
+            cur.close()
+        else:
+            cur = self._conn.cursor()
+            cur.row_factory = row_factory
+            for place_ids in place_id_batches:
+                batch_predicates = [
+                    MozillaPlacesDatabase._WHERE_PLACE_ID_IN_PREDICATE.format(
+                        parameter_question_marks=",".join("?" for _ in range(len(place_ids)))),
+                    *predicates
+                ]
+                query = f"{MozillaPlacesDatabase._HISTORY_QUERY} WHERE {' AND '.join(batch_predicates)};"
+                yield from cur.execute(query, [*place_ids, *parameters])
+
+            cur.close()
 
     def iter_downloads(self):
         cur = self._conn.cursor()
         attrib_cur = self._conn.cursor()
 
-        cur.execute(" ".join(
-            (MozillaPlacesDatabase._HISTORY_QUERY,
-             "WHERE",
-             MozillaPlacesDatabase._WHERE_VISIT_IS_DOWNLOAD_PREDICATE)) + ";")
+        cur.execute(MozillaPlacesDatabase._HISTORY_DOWNLOADS_QUERY)
         for row in cur:
-            attrib_cur.execute(MozillaPlacesDatabase._DOWNLOAD_ATTRIBUTES_QUERY, (row["place_id"], ))
-            attributes = {x["name"]: x["content"] for x in attrib_cur}
+            visit_id, url, title, _, place_id, visit_date, visit_type, from_visit = row
+            attrib_cur.execute(MozillaPlacesDatabase._DOWNLOAD_ATTRIBUTES_QUERY, (place_id, ))
+            attributes = {name: content for name, content, _, _ in attrib_cur}
 
             metadata = json.loads(attributes.get(MozillaPlacesDatabase._DOWNLOAD_METADATA_KEY, "{}"))
             file_location = attributes.get(MozillaPlacesDatabase._DOWNLOAD_DESTINATION_FILE_URI_KEY)
 
             yield MozillaDownload(
                 self,
-                row["id"],
-                row["url"],
-                row["title"],
-                parse_unix_microseconds(row["visit_date"]),
-                VisitType(row["visit_type"]),
-                row["from_visit"],
+                visit_id,
+                url,
+                title,
+                parse_unix_microseconds(visit_date),
+                _lookup_visit_type(visit_type),
+                from_visit,
                 file_location,
                 metadata.get("deleted"),
                 parse_unix_milliseconds(metadata.get("endTime", 0)),
@@ -303,6 +415,7 @@ class MozillaPlacesDatabase:
             )
 
     def close(self):
+        self._lookup_cur.close()
         self._conn.close()
 
     def __enter__(self) -> "MozillaPlacesDatabase":
@@ -21,12 +21,13 @@ SOFTWARE.
 """
 
 import sys
+import collections
 import pathlib
 import dataclasses
 import typing
 import re
 import collections.abc as col_abc
-from .common import KeySearch, is_keysearch_hit
+from .common import KeySearch, make_keysearch_predicate, make_pattern_predicate
 from .storage_formats import moz_lz4
 
 
@@ -55,23 +56,25 @@ class SessionStorage:
     """
 
     def __init__(self, profile_path: pathlib.Path):
-        self._host_lookup = {}  # {host: {key: [value, ...]}}
+        host_lookup = collections.defaultdict(lambda: collections.defaultdict(list))
 
         session_store_path = profile_path / "sessionstore.jsonlz4"
         if session_store_path.is_file():
             for rec in SessionStorage._get_records_from_file(session_store_path):
-                self._host_lookup.setdefault(rec.host, {})
-                self._host_lookup[rec.host].setdefault(rec.key, [])
-                self._host_lookup[rec.host][rec.key].append(rec)
+                host_lookup[rec.host][rec.key].append(rec)
 
         session_store_backups_path = profile_path / "sessionstore-backups"
         if session_store_backups_path.is_dir():
             for ss_backup_path in session_store_backups_path.iterdir():
                 if "jsonlz4" in ss_backup_path.suffix or ss_backup_path.suffix == ".baklz4":
                     for rec in SessionStorage._get_records_from_file(ss_backup_path):
-                        self._host_lookup.setdefault(rec.host, {})
-                        self._host_lookup[rec.host].setdefault(rec.key, [])
-                        self._host_lookup[rec.host][rec.key].append(rec)
+                        host_lookup[rec.host][rec.key].append(rec)
+
+        # plain dicts from here on so that lookups for missing hosts or keys don't add entries
+        self._host_lookup = {host: dict(keys) for host, keys in host_lookup.items()}  # {host: {key: [value, ...]}}
+
+        # the hosts don't change once collected, so the hosts matching a given pattern can be remembered
+        self._pattern_hits_cache: dict[re.Pattern, tuple[str, ...]] = {}
 
     @staticmethod
     def _get_storage_from_tab(
@@ -104,7 +107,11 @@ class SessionStorage:
         if isinstance(host, str):
             return [host] if host in self._host_lookup else []
         elif isinstance(host, re.Pattern):
-            return [x for x in self._host_lookup if host.search(x)]
+            hits = self._pattern_hits_cache.get(host)
+            if hits is None:
+                hits = tuple(filter(make_pattern_predicate(host), self._host_lookup))
+                self._pattern_hits_cache[host] = hits
+            return list(hits)
         elif isinstance(host, col_abc.Collection):
             return list(set(host) & self._host_lookup.keys())
         elif isinstance(host, col_abc.Callable):
@@ -125,12 +132,14 @@ class SessionStorage:
             if not host_hits and raise_on_no_results:
                 raise KeyError((host, key))
 
+        key_predicate = None if key is None else make_keysearch_predicate(key)
+
         yielded = False
         for host_hit in host_hits:
-            if key is None:
+            if key_predicate is None:
                 key_hits = self._host_lookup[host_hit].keys()
             else:
-                key_hits = [k for k in self._host_lookup[host_hit].keys() if is_keysearch_hit(key, k)]
+                key_hits = [k for k in self._host_lookup[host_hit].keys() if key_predicate(k)]
 
             for key_hit in key_hits:
                 yielded = True
@@ -6,6 +6,8 @@ and referenced as a dependency.
 
 """
 
+import functools
+import operator
 import re
 import typing
 import collections.abc as col_abc
@@ -13,6 +15,9 @@ import collections.abc as col_abc
 
 KeySearch = typing.Union[str, re.Pattern, col_abc.Collection[str], col_abc.Callable[[str], bool]]
 
+# characters with a special meaning in a regular expression; a pattern without any is just a substring search
+_REGEX_SPECIAL_CHARS = frozenset(".^$*+?{}[]\\|()")
+
 
 def is_keysearch_hit(search: KeySearch, value: str):
     if isinstance(search, str):
@@ -24,4 +29,39 @@ def is_keysearch_hit(search: KeySearch, value: str):
     elif isinstance(search, col_abc.Callable):
         return search(value)
     else:
-        raise TypeError(f"Unexpected type: {type(search)} (expects: {KeySearch})")
\ No newline at end of file
+        raise TypeError(f"Unexpected type: {type(search)} (expects: {KeySearch})")
+
+
+def make_keysearch_predicate(search: KeySearch) -> col_abc.Callable[[str], bool]:
+    """
+    Does the type checking for search once, returning a callable which gives the same result as is_keysearch_hit,
+    for use when testing lots of values against the same search.
+    """
+    if isinstance(search, str):
+        return functools.partial(operator.eq, search)
+    elif isinstance(search, re.Pattern):
+        return make_pattern_predicate(search)
+    elif isinstance(search, col_abc.Collection):
+        return frozenset(search).__contains__
+    elif isinstance(search, col_abc.Callable):
+        return search
+    else:
+        raise TypeError(f"Unexpected type: {type(search)} (expects: {KeySearch})")
+
+
+def make_pattern_predicate(pattern: re.Pattern) -> col_abc.Callable[[str], bool]:
+    """
+    Returns a callable which tests whether pattern.search finds a match in a value. Patterns which are actually plain
+    text (optionally anchored to the start) are common for things like hosts, so these are tested with the str
+    methods instead of the regular expression engine.
+    """
+    text = pattern.pattern
+    if isinstance(text, str) and pattern.flags == re.compile(text).flags:
+        anchored = text.startswith("^")
+        literal = text[1:] if anchored else text
+        if _REGEX_SPECIAL_CHARS.isdisjoint(literal):
+            if anchored:
+                return lambda value: value.startswith(literal)
+            return lambda value: literal in value
+
+    return lambda value: pattern.search(value) is not None
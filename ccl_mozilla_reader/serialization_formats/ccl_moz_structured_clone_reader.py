@@ -20,10 +20,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import codecs
+import collections.abc as col_abc
 import dataclasses
 import datetime
 import enum
-import os
+import functools
 import re
 import struct
 import sys
@@ -40,8 +42,40 @@ __contact__ = "Alex Caithness"
 # also: dom/indexedDB/IndexedDatabase.cpp
 
 
-class EndOfKeysException(Exception):
-    ...  # thrown when an end of keys tag is encountered to be handled by the collection readers
+_PAIR = struct.Struct("<2I")
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_UINT64 = struct.Struct("<Q")
+_DOUBLE = struct.Struct("<d")
+# pairs which hold a double are reinterpreted through these
+_UINT64_BE = struct.Struct(">Q")
+_DOUBLE_BE = struct.Struct(">d")
+
+
+# latin-1 strings of at least this length (in bytes) are decoded without copying the data first
+_LATIN_1_VIEW_DECODE_THRESHOLD = 16384
+
+# strings up to this length (in bytes) are interned
+_MAX_INTERNED_STRING_LENGTH = 64
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_regexp(pattern: str) -> re.Pattern:
+    # re's own cache only holds 512 patterns and is shared with everything else in the process, so large clones with
+    # lots of (often repeated) RegExp objects get a cache of their own
+    return re.compile(pattern)
+
+
+def _js_time_to_datetime(milliseconds: float) -> datetime.datetime:
+    # timedelta's 4th positional argument is milliseconds; passing it positionally skips the keyword parsing
+    return _EPOCH + datetime.timedelta(0, 0, 0, milliseconds)
+
+
+# returned by _read_item when an END_OF_KEYS tag is read, for _read_contents to spot the end of a map or set
+_KEYS_ENDED = object()
 
 
 class StructuredCloneReaderError(Exception):
@@ -114,17 +148,18 @@ class ScalarType(enum.IntEnum):
     def data_to_array(self, data: bytes, element_count: int, start_offset: int):
         if len(data) == 0:
             return []
-        element_size = _SCALAR_TYPE_ELEMENT_LENGTH[self]
-        if (len(data) - start_offset) / element_size < element_count:
+        byte_length = element_count * _SCALAR_TYPE_ELEMENT_LENGTH[self]
+        if len(data) - start_offset < byte_length:
             raise ValueError(
                 f"Invalid length for data to be converted to a typed array of {self.name} of length {element_count}")
 
-        # special case for Uint8Clamped as it's usually just a byte array
-        if self == self.Uint8Clamped:
+        # special case for Uint8Clamped as it's usually just a byte array. The slice copies, but returning a view would
+        # keep the whole clone buffer alive for as long as the value is
+        if self is ScalarType.Uint8Clamped:
             return data[start_offset:start_offset + element_count]
 
-        struct_fmt = f"<{element_count}{_SCALAR_TYPE_STRUCT_CODE[self]}"
-        return struct.unpack(struct_fmt, data[start_offset:(element_count * element_size) + start_offset])
+        # N.B. a LazyTypedArray rather than the tuple which was returned previously (see its docstring)
+        return LazyTypedArray(self, data, start_offset, element_count)
 
 
 _SCALAR_TYPE_ELEMENT_LENGTH = {
@@ -156,6 +191,88 @@ _SCALAR_TYPE_STRUCT_CODE = {
 }
 
 
+@functools.lru_cache(maxsize=256)
+def _typed_array_struct(scalar_type: ScalarType, element_count: int) -> struct.Struct:
+    # typed arrays of the same type and length tend to come up repeatedly, so reuse the compiled structs
+    return struct.Struct(f"<{element_count}{_SCALAR_TYPE_STRUCT_CODE[scalar_type]}")
+
+
+class LazyTypedArray(col_abc.Sequence):
+    """
+    A read-only sequence over the elements of a typed array which are only unpacked from the backing buffer when they
+    are accessed, as large typed arrays are often never looked at element by element.
+
+    Typed arrays used to be returned as tuples, and this isn't one: it compares equal to (and hashes the same as) the
+    equivalent tuple, but isinstance(x, tuple) checks and JSON serialisation need to_tuple() (or list(x)) first.
+    """
+    def __init__(self, scalar_type: ScalarType, data: bytes, start_offset: int, element_count: int):
+        self._scalar_type = scalar_type
+        self._data = data
+        self._start_offset = start_offset
+        self._element_count = element_count
+        self._element_struct = _typed_array_struct(scalar_type, 1)
+
+    @property
+    def scalar_type(self) -> ScalarType:
+        return self._scalar_type
+
+    @property
+    def raw_data(self) -> bytes:
+        """
+        :return: the bytes which make up this typed array (a copy of that part of the backing buffer)
+        """
+        return self._data[self._start_offset:self._start_offset + self._element_count * self._element_struct.size]
+
+    def to_tuple(self) -> tuple:
+        """
+        :return: all the elements unpacked in one go
+        """
+        return _typed_array_struct(self._scalar_type, self._element_count).unpack_from(self._data, self._start_offset)
+
+    def __buffer__(self, flags: int) -> memoryview:
+        # exposes the elements without copying them (e.g. for memoryview(array) or numpy.frombuffer(array, ...)).
+        # The data is little-endian, so it can only be presented as typed elements on a little-endian host,
+        # otherwise it's presented as the raw bytes.
+        view = memoryview(self._data)[
+               self._start_offset:self._start_offset + self._element_count * self._element_struct.size]
+        if sys.byteorder == "little":
+            view = view.cast(_SCALAR_TYPE_STRUCT_CODE[self._scalar_type])
+        return view
+
+    def __len__(self):
+        return self._element_count
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return tuple(self[i] for i in range(*item.indices(self._element_count)))
+        if item < 0:
+            item += self._element_count
+        if not 0 <= item < self._element_count:
+            raise IndexError("typed array index out of range")
+        return self._element_struct.unpack_from(self._data, self._start_offset + item * self._element_struct.size)[0]
+
+    def __iter__(self):
+        view = memoryview(self._data)[
+               self._start_offset:self._start_offset + self._element_count * self._element_struct.size]
+        for value, in self._element_struct.iter_unpack(view):
+            yield value
+
+    def __eq__(self, other):
+        if isinstance(other, LazyTypedArray):
+            return self._scalar_type == other._scalar_type and self.to_tuple() == other.to_tuple()
+        if isinstance(other, (tuple, list)):
+            return self.to_tuple() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        # the backing data is immutable bytes, so this is stable; it matches the tuple it compares equal to so that
+        # typed arrays can still be used as Map keys and Set members
+        return hash(self.to_tuple())
+
+    def __repr__(self):
+        return f"<LazyTypedArray {self._scalar_type.name} {list(self.to_tuple())}>"
+
+
 class StructuredDataType(enum.IntEnum):
     # For values before END_OF_BUILTIN_TYPES:
     # js/src/vm/StructuredClone.cpp
@@ -286,6 +403,31 @@ class StructuredDataType(enum.IntEnum):
     DOM_ENCODEDAUDIOCHUNK = enum.auto()
 
 
+_STRUCTURED_DATA_TYPE_VALUES = frozenset(tag.value for tag in StructuredDataType)
+# tags below this are actually the upper half of a double
+_FLOAT_MAX = StructuredDataType.FLOAT_MAX.value
+
+# the types of value which can be used as a key when reading arrays and objects
+_ARRAY_KEY_TAGS = (StructuredDataType.INT32.value,)
+_OBJECT_KEY_TAGS = (StructuredDataType.STRING.value, StructuredDataType.STRING_OBJECT.value)
+_STRING_TAG = StructuredDataType.STRING.value
+_ARRAY_TAG = StructuredDataType.ARRAY_OBJECT.value
+_OBJECT_TAG = StructuredDataType.OBJECT_OBJECT.value
+_SET_TAG = StructuredDataType.SET_OBJECT.value
+_STRING_TAGS = (StructuredDataType.STRING.value, StructuredDataType.STRING_OBJECT.value)
+_END_OF_KEYS = StructuredDataType.END_OF_KEYS.value
+_BIGINT_TAGS = (StructuredDataType.BIGINT.value, StructuredDataType.BIGINT_OBJECT.value)
+
+# the primitives which are decoded entirely from their pair, handled before the handler lookup in _read
+_NULL_TAG = StructuredDataType.NULL.value
+_BOOLEAN_TAG = StructuredDataType.BOOLEAN.value
+_INT32_TAG = StructuredDataType.INT32.value
+
+
+def _tag_name(tag: int) -> str:
+    return StructuredDataType(tag).name if tag in _STRUCTURED_DATA_TYPE_VALUES else hex(tag)
+
+
 class CryptoType(enum.IntEnum):
     AES = 0
     HMAC = enum.auto()
@@ -295,19 +437,19 @@ class CryptoType(enum.IntEnum):
     ED = enum.auto()
 
 
-@dataclasses.dataclass(frozen=True)
-class Pair:
+class Pair(typing.NamedTuple):
+    # a lightweight tuple as one of these is made for every value read; data and tag come straight out of a pair of
+    # uint32s so are always in range
     data: int
     tag: StructuredDataType | int
 
-    def __post_init__(self):
-        if self.data < 0 or self.tag < 0 or self.data > 0xffffffff or self.tag > 0xffffffff:
-            raise ValueError("data and tag must be in the range of 0-0xffffffff")
-
     def to_double(self):
         int64_value = (self.tag << 32) | self.data
-        buff = struct.pack(">Q", int64_value)
-        return struct.unpack(">d", buff)[0]
+        return _DOUBLE_BE.unpack(_UINT64_BE.pack(int64_value))[0]
+
+
+# builds a Pair from a (data, tag) tuple without going through the generated (pure python) NamedTuple __new__
+_new_pair = functools.partial(tuple.__new__, Pair)
 
 
 class _Undefined:
@@ -326,6 +468,17 @@ class _Undefined:
         return "<Undefined>"
 
 
+class _PendingContainer:
+    # an array, object, map or set which has been created by _open_container but not yet populated. Length is only
+    # meaningful for arrays
+    __slots__ = ("tag", "value", "length")
+
+    def __init__(self, tag: int, value: typing.Union[list, dict, set], length: int):
+        self.tag = tag
+        self.value = value
+        self.length = length
+
+
 # @dataclasses.dataclass
 # class BackReference:
 #     index: int
@@ -355,200 +508,288 @@ class CryptoKey:
     parameters: typing.Mapping
 
 
-def unsparse_array(result: list, length: int, sparse_dict: dict[int, typing.Any], default) -> list:
-    if len(sparse_dict) == 0:
-        return []
-
-    if any(not isinstance(x, int) or x < 0 for x in sparse_dict.keys()):
-        raise ValueError("all dict keys must be positive ints for a sparse array")
-
-    if max(sparse_dict.keys()) >= length:
-        raise ValueError("length is too low for the maximum key")
-
-    result.clear()
-    result.extend(default for _ in range(length))
-    for k, v in sparse_dict.items():
-        result[k] = v
-
-    return result
-
-
 class StructuredCloneReader:
     UNDEFINED = _Undefined()
 
     def __init__(self, stream: typing.BinaryIO):
-        self._f = stream
+        # the whole of the data is read up front and parsed from memory; offsets are relative to the stream's position
+        # when it was passed in
+        self._buf = stream.read()
+        self._view = memoryview(self._buf)
+        self._pos = 0
 
         header_pair = self._read_pair()
         if header_pair.tag != StructuredDataType.HEADER:
             raise StructuredCloneReaderError("Structured clone data does not start with HEADER")
 
         self._scope = header_pair.data
+        # objects in the order they were read, which back references refer to by index. Appending to a list is already
+        # amortised O(1), so there's nothing to gain from presizing it, but the bound append is kept to save the
+        # attribute lookups for every object
         self._flattened_objects = []
+        self._add_flattened_object = self._flattened_objects.append
 
-    def _read_raw(self, length):
+    def _read_bytes(self, length) -> bytes:
         """
         It's a read but checks for the right number of bytes read before returning.
-        Prefer this over a basic call to the stream's read function in most cases.
-        It also returns the starting offset of the read in case we need that.
 
         :param length:
-        :return: a tuple of the start offset for the read and the data read
+        :return: the data read
         """
-        start_offset = self._f.tell()
-        data = self._f.read(length)
+        start_offset = self._pos
+        data = self._buf[start_offset:start_offset + length]
         if len(data) != length:
-            raise StructuredCloneReaderError(
-                f"Could not read enough data at {start_offset} (wanted: {length}; got: {len(data)}")
-        return start_offset, data
+            raise self._not_enough_data_error(start_offset, length)
+        self._pos = start_offset + length
+        return data
+
+    def _read_view(self, length) -> memoryview:
+        """
+        As per _read_bytes, but returns a view onto the data rather than a copy, for data which is going to be decoded
+        straight away.
+
+        :param length:
+        :return: a memoryview of the data read
+        """
+        start_offset = self._pos
+        data = self._view[start_offset:start_offset + length]
+        if len(data) != length:
+            raise self._not_enough_data_error(start_offset, length)
+        self._pos = start_offset + length
+        return data
+
+    def _unpack(self, fixed_struct: struct.Struct) -> tuple:
+        """
+        Unpacks a fixed size value at the current offset without taking a copy of the data first
+
+        :param fixed_struct: the struct to unpack
+        :return: the unpacked tuple
+        """
+        start_offset = self._pos
+        try:
+            # unpack_from does its own bounds checking, so there's no need to repeat it here
+            result = fixed_struct.unpack_from(self._buf, start_offset)
+        except struct.error:
+            raise self._not_enough_data_error(start_offset, fixed_struct.size)
+        self._pos = start_offset + fixed_struct.size
+        return result
+
+    def _not_enough_data_error(self, start_offset: int, length: int) -> StructuredCloneReaderError:
+        return StructuredCloneReaderError(
+            f"Could not read enough data at {start_offset} "
+            f"(wanted: {length}; got: {max(len(self._buf) - start_offset, 0)}")
 
     def _read_pair(self) -> Pair:
-        _, buff = self._read_raw(8)
-        data, tag = struct.unpack("<2I", buff)
-        if tag < StructuredDataType.FLOAT_MAX:
-            return Pair(data, tag)
-        else:
-            return Pair(data, StructuredDataType(tag))
+        # the tag is left as an int (which compares equal to the StructuredDataType members) rather than building an
+        # enum for every pair; use _tag_name for display
+        return _new_pair(self._unpack(_PAIR))
 
     def _read_int(self) -> int:
-        _, buff = self._read_raw(4)
-        val, = struct.unpack("<i", buff)
+        val, = self._unpack(_INT32)
         return val
 
     def _read_uint(self) -> int:
-        _, buff = self._read_raw(4)
-        val, = struct.unpack("<I", buff)
+        val, = self._unpack(_UINT32)
         return val
 
     def _read_long(self) -> int:
-        _, buff = self._read_raw(8)
-        val, = struct.unpack("<q", buff)
+        val, = self._unpack(_INT64)
         return val
 
     def _read_ulong(self) -> int:
-        _, buff = self._read_raw(8)
-        val, = struct.unpack("<Q", buff)
+        val, = self._unpack(_UINT64)
         return val
 
     def _read_double(self) -> float:
-        _, buff = self._read_raw(8)
-        val, = struct.unpack("<d", buff)
+        val, = self._unpack(_DOUBLE)
         return val
 
     def read_structuredclonereader_string(self):
         # from dom/indexedDB/IndexedDatabase.cpp used by some of the non-builtin types
         string_length = self._read_uint()
         self._align()
-        _, raw = self._read_raw(string_length)
+        raw = self._read_bytes(string_length)
         self._align()
         return raw.decode("utf-8")
 
     def _read_string_internal(self, pair: Pair) -> str:
-        if pair.tag not in (StructuredDataType.STRING, StructuredDataType.STRING_OBJECT):
-            raise StructuredCloneReaderError(f"Unexpected tag in pair when reading string ({pair.tag})")
+        if pair.tag not in _STRING_TAGS:
+            raise StructuredCloneReaderError(f"Unexpected tag in pair when reading string ({_tag_name(pair.tag)})")
 
         # pair data contains the encoding and length
         if pair.data & 0x80000000 == 0:
             # encoding is utf-16, length is codepoints so must be doubled
             length = 2 * (pair.data & 0x7fffffff)
-            _, buff = self._read_raw(length)
-            return buff.decode("utf-16-le")
+            result = self._read_utf16(pair.data & 0x7fffffff)
         else:
-            # encoding is latin-1
+            # encoding is latin-1. bytes.decode is special-cased for latin-1 which makes slicing and decoding quickest
+            # for most strings, but for long ones it's the copy of the data which dominates, so decode from a view
             length = pair.data & 0x7fffffff
-            _, buff = self._read_raw(length)
-            return buff.decode("latin-1")
+            if length < _LATIN_1_VIEW_DECODE_THRESHOLD:
+                start_offset = self._pos
+                buff = self._buf[start_offset:start_offset + length]
+                if len(buff) != length:
+                    raise self._not_enough_data_error(start_offset, length)
+                self._pos = start_offset + length
+                result = buff.decode("latin-1")
+            else:
+                result = codecs.latin_1_decode(self._read_view(length))[0]
+
+        # short strings (e.g. object keys) tend to be repeated many times over, so share a single copy of each
+        if length <= _MAX_INTERNED_STRING_LENGTH and pair.tag == _STRING_TAG:
+            result = sys.intern(result)
+        return result
+
+    def _read_utf16(self, length) -> str:
+        """
+        Reads a little-endian UTF-16 string. JS strings can contain unpaired surrogates, hence "surrogatepass".
+        Decoding from a view of the buffer (with the codec function directly) saves a copy of the data and the
+        codec lookup.
+
+        :param length: the length of the string in UTF-16 code units
+        """
+        return codecs.utf_16_le_decode(self._read_view(2 * length), "surrogatepass", True)[0]
 
     def _read_string(self) -> str:
         pair = self._read_pair()
         return self._read_string_internal(pair)
 
     def _read_bigint(self, pair: Pair):
-        if pair.tag not in (StructuredDataType.BIGINT, StructuredDataType.BIGINT_OBJECT):
-            raise ValueError(f"Unexpected tag in pair when reading bigint ({pair.tag})")
+        if pair.tag not in _BIGINT_TAGS:
+            raise ValueError(f"Unexpected tag in pair when reading bigint ({_tag_name(pair.tag)})")
 
-        # length is expressed as a count of 64-bit allocations
+        # length is expressed as a count of 64-bit digits, least significant first
+        # (see: JSStructuredCloneWriter::writeBigInt)
         length = 8 * (pair.data & 0x7fffffff)
         is_negative = pair.data & 0x80000000 != 0
-        _, raw = self._read_raw(length)
-        # TODO: format into a bigint actually
-        result = int.from_bytes(raw, "little", signed=False)
+        result = int.from_bytes(self._read_view(length), "little", signed=False)
         if is_negative:
             result = -result
         return result
 
-    def _read_array(self, pair: Pair) -> list:
-        if pair.tag != StructuredDataType.ARRAY_OBJECT:
-            raise ValueError("Pair tag isn't ARRAY_OBJECT")
-
-        array_length = pair.data
-
-        result = []
-        sparse_dict = {}
-        self._flattened_objects.append(result)  # must be added before population
-        while True:
-            try:
-                key = self._read(StructuredDataType.INT32, StructuredDataType.END_OF_KEYS)
-            except EndOfKeysException:
-                break
-
-            value = self._read()
-
-            sparse_dict[key] = value
-        return unsparse_array(result, array_length, sparse_dict, self.UNDEFINED)
-
-    def _read_set(self, pair: Pair) -> set:
-        if pair.tag != StructuredDataType.SET_OBJECT:
-            raise ValueError("Pair tag isn't SET_OBJECT")
-
-        result = set()
-        self._flattened_objects.append(result)
-        while True:
-            try:
-                value = self._read()
-            except EndOfKeysException:
-                break
-
-            result.add(value)
-
-        return result
-
-    def _read_object(self, pair: Pair) -> dict[str, typing.Any]:
-        if pair.tag != StructuredDataType.OBJECT_OBJECT:
-            raise ValueError("Pair tag isn't OBJECT_OBJECT")
-
-        result = {}
-        self._flattened_objects.append(result)
-        while True:
-            try:
-                key = self._read(
-                    StructuredDataType.STRING,
-                    StructuredDataType.STRING_OBJECT,
-                    StructuredDataType.END_OF_KEYS)
-            except EndOfKeysException:
-                break
-
-            value = self._read()
-            result[key] = value
-
-        return result
-
-    def _read_map(self, pair: Pair):
-        if pair.tag != StructuredDataType.MAP_OBJECT:
-            raise ValueError("Pair tag isn't MAP_OBJECT")
+    def _read_key_pair(self, key_tags: tuple[int, ...]) -> typing.Optional[Pair]:
+        """
+        Reads the pair for the next key of an array or object, which can only be one of a few types, without going
+        through the general dispatch in _read.
 
-        result = {}
-        self._flattened_objects.append(result)
-        while True:
-            try:
-                key = self._read()
-            except EndOfKeysException:
-                break
+        :param key_tags: the tags which are valid for the key
+        :return: the key's pair, or None if the end of the keys has been reached
+        """
+        # aligned and unpacked inline, as per _read
+        start_offset = (self._pos + 7) & ~7
+        try:
+            data, tag = _PAIR.unpack_from(self._buf, start_offset)
+        except struct.error:
+            raise self._not_enough_data_error(start_offset, _PAIR.size)
+        self._pos = start_offset + _PAIR.size
+        if tag == _END_OF_KEYS:
+            return None
+        if tag not in key_tags:
+            expected_names = ", ".join(map(_tag_name, (*key_tags, StructuredDataType.END_OF_KEYS)))
+            raise StructuredCloneReaderError(f"Expected a pair with one of: {expected_names}, but got {_tag_name(tag)}")
+        return _new_pair((data, tag))
+
+    def _open_container(self, pair: Pair) -> "_PendingContainer":
+        # the container is created (and added to the flattened objects, so that it can be back-referenced from within
+        # itself) straight away, but its contents are read by _read_contents
+        if pair.tag == _ARRAY_TAG:
+            result = []
+        elif pair.tag == _SET_TAG:
+            result = set()
+        else:
+            result = {}
+        self._add_flattened_object(result)
+        return _PendingContainer(pair.tag, result, pair.data)
 
-            value = self._read()
-            result[key] = value
+    def _read_contents(self, container: "_PendingContainer"):
+        """
+        Reads the contents of an array, object, map or set along with those of any containers nested within it. This
+        works through an explicit stack rather than recursing for each level of nesting so that deeply nested data
+        doesn't run into the interpreter's recursion limit. Nested containers are put in place in their parent as soon
+        as they are created as, being mutable, they can be populated afterwards.
 
-        return result
+        :param container: the container returned by _open_container
+        :return: the populated container
+        """
+        read_item = self._read_item
+        read_key_pair = self._read_key_pair
+        stack = [container]
+        while stack:
+            # each container's entries are read in a loop of their own until it either ends (and is popped) or a nested
+            # container is found (which is pushed and the loop broken out of so that it gets populated first)
+            current = stack[-1]
+            result = current.value
+
+            if current.tag == _ARRAY_TAG:
+                array_length = current.length
+                while (key_pair := read_key_pair(_ARRAY_KEY_TAGS)) is not None:
+                    key = self._handle_int32(key_pair)
+                    if not 0 <= key < array_length:
+                        raise ValueError(f"array index {key} is out of range for an array of length {array_length}")
+
+                    value = nested = read_item(())
+                    if type(nested) is _PendingContainer:
+                        value = nested.value
+                    elif value is _KEYS_ENDED:
+                        raise StructuredCloneReaderError(f"Array ended before the value for index {key}")
+
+                    # the elements usually come in index order with no holes, so the list is grown as they are read,
+                    # filling any holes with UNDEFINED
+                    if key == len(result):
+                        result.append(value)
+                    elif key > len(result):
+                        result.extend([self.UNDEFINED] * (key - len(result)))
+                        result.append(value)
+                    else:
+                        result[key] = value
+
+                    if value is not nested:
+                        stack.append(nested)
+                        break
+                else:
+                    # pad out any holes at the end of the array
+                    if len(result) < array_length:
+                        result.extend([self.UNDEFINED] * (array_length - len(result)))
+                    stack.pop()
+
+            elif current.tag == _OBJECT_TAG:
+                while (key_pair := read_key_pair(_OBJECT_KEY_TAGS)) is not None:
+                    key = self._handle_string(key_pair)
+                    value = read_item(())
+                    if type(value) is _PendingContainer:
+                        result[key] = value.value
+                        stack.append(value)
+                        break
+                    if value is _KEYS_ENDED:
+                        raise StructuredCloneReaderError(f"Object ended before the value for key {key!r}")
+                    result[key] = value
+                else:
+                    stack.pop()
+
+            else:
+                # maps and sets, which are ended by an END_OF_KEYS in place of a key/value
+                is_set = current.tag == _SET_TAG
+                while (key := read_item(())) is not _KEYS_ENDED:
+                    if type(key) is _PendingContainer:
+                        # arrays, objects, maps and sets can't be hashed, so can't go into a set or be used as a key
+                        raise TypeError(f"unhashable type: '{type(key.value).__name__}'")
+
+                    if is_set:
+                        result.add(key)
+                        continue
+
+                    value = read_item(())
+                    if type(value) is _PendingContainer:
+                        result[key] = value.value
+                        stack.append(value)
+                        break
+                    if value is _KEYS_ENDED:
+                        raise StructuredCloneReaderError("Map ended between a key and its value")
+                    result[key] = value
+                else:
+                    stack.pop()
+
+        return container.value
 
     def _read_typed_array(self, pair: Pair, is_v1_format: bool):
         if is_v1_format:
@@ -577,7 +818,7 @@ class StructuredCloneReader:
 
         start_offset = self._read_ulong()
 
-        return array_type.data_to_array(backing_buffer, element_count,start_offset)
+        return array_type.data_to_array(backing_buffer, element_count, start_offset)
 
     def _read_blob(self, pair: Pair) -> Blob:
         # dom/indexedDB/IndexedDatabase.cpp - ReadBlobOrFile
@@ -601,9 +842,7 @@ class StructuredCloneReader:
         mime_type = self.read_structuredclonereader_string()
 
         if pair.tag == StructuredDataType.DOM_FILE:
-            last_modified = self._read_double()
-            last_modified = datetime.datetime(
-                1970, 1, 1) + datetime.timedelta(milliseconds=last_modified)
+            last_modified = _js_time_to_datetime(self._read_double())
         else:
             last_modified = None
         self._align()
@@ -623,21 +862,20 @@ class StructuredCloneReader:
 
         # reads beyond this point should be aligned
         _, sym_key_length = self._read_uint(), self._read_uint()
-        _, sym_key = self._read_raw(sym_key_length)
+        sym_key = self._read_bytes(sym_key_length)
         self._align()
 
         _, priv_key_length = self._read_uint(), self._read_uint()
-        _, priv_key = self._read_raw(priv_key_length)
+        priv_key = self._read_bytes(priv_key_length)
         self._align()
 
         _, pub_key_length = self._read_uint(), self._read_uint()
-        _, pub_key = self._read_raw(pub_key_length)
+        pub_key = self._read_bytes(pub_key_length)
         self._align()
 
         # dom/crypto/KeyAlgorithmProxy.cpp - KeyAlgorithmProxy::ReadStructuredClone
         _, name_length = self._read_uint(), self._read_uint()
-        _, name = self._read_raw(name_length * 2)  # UTF-16, length is codepoints
-        name = name.decode("utf-16-le")
+        name = self._read_utf16(name_length)
         self._align()
 
         proxy_version, algo = self._read_uint(), CryptoType(self._read_uint())
@@ -654,24 +892,24 @@ class StructuredCloneReader:
             case CryptoType.HMAC:
                 _, length = self._read_uint(), self._read_uint()
                 _, hashname_length = self._read_uint(), self._read_uint()
-                _, hash_name = self._read_raw(hashname_length * 2)  # utf-16
+                hash_name = self._read_utf16(hashname_length)
                 self._align()
                 parameters["length"] = length
-                parameters["hash"] = hash_name.decode("utf-16-le")
+                parameters["hash"] = hash_name
             case CryptoType.RSA:
                 _, modulus_length = self._read_uint(), self._read_uint()
                 _, public_exponent_length = self._read_uint(), self._read_uint()
-                _, public_exponent = self._read_raw(public_exponent_length)
+                public_exponent = self._read_bytes(public_exponent_length)
                 self._align()
                 _, hashname_length = self._read_uint(), self._read_uint()
-                _, hash_name = self._read_raw(hashname_length * 2)  # utf-16
+                hash_name = self._read_utf16(hashname_length)
                 self._align()
                 parameters["modulus_length"] = modulus_length
                 parameters["public_exponent"] = public_exponent
-                parameters["hash"] = hash_name.decode("utf-16-le")
+                parameters["hash"] = hash_name
             case CryptoType.EC:
                 _, named_curve_length = self._read_uint(), self._read_uint()
-                _, named_curve = self._read_raw(named_curve_length * 2)  # utf-16
+                named_curve = self._read_bytes(named_curve_length * 2)  # utf-16
                 self._align()
                 parameters["named_curve"] = named_curve
             case CryptoType.ED:
@@ -682,106 +920,161 @@ class StructuredCloneReader:
         return CryptoKey(sym_key or None, priv_key or None, pub_key or None, types.MappingProxyType(parameters))
 
     def _align(self):
-        alignment = self._f.tell() % 8
-        if alignment != 0:
-            self._f.seek(8 - alignment, os.SEEK_CUR)
+        # round up to the next multiple of 8
+        self._pos = (self._pos + 7) & ~7
 
     def _read(self, *expected_tags):
-        # Align to int64 before reading each pair
-        self._align()
-        start_offset = self._f.tell()
-        # print(f"reading new pair at {start_offset}")
-        pair = self._read_pair()
-        # print(f"pair is {pair}")
+        result = self._read_item(expected_tags)
+        if type(result) is _PendingContainer:
+            result = self._read_contents(result)
+        elif result is _KEYS_ENDED:
+            raise StructuredCloneReaderError("Unexpected END_OF_KEYS outside of an array, object, map or set")
+        return result
 
-        if expected_tags and pair.tag not in expected_tags:
-            raise StructuredCloneReaderError(f"Expected a pair with one of: {', '.join(expected_tags)}, but got {pair.tag}")
+    def _read_item(self, expected_tags: tuple[int, ...]):
+        """
+        Reads a single value. Arrays, objects, maps and sets are returned as a _PendingContainer whose contents still
+        need reading with _read_contents; use _read unless dealing with that yourself.
 
-        if pair.tag < StructuredDataType.FLOAT_MAX:
-            return pair.to_double()
+        :param expected_tags: the tags which are valid at this point, or empty to allow any
+        :return: the value read
+        """
+        # this is called for every value, so the alignment (to int64 before reading each pair) and the read of the pair
+        # are done inline rather than through _align and _unpack
+        start_offset = (self._pos + 7) & ~7
+        try:
+            data, tag = _PAIR.unpack_from(self._buf, start_offset)
+        except struct.error:
+            raise self._not_enough_data_error(start_offset, _PAIR.size)
+        self._pos = start_offset + _PAIR.size
+
+        if expected_tags and tag not in expected_tags:
+            raise StructuredCloneReaderError(
+                f"Expected a pair with one of: {', '.join(map(_tag_name, expected_tags))}, "
+                f"but got {_tag_name(tag)}")
+
+        if tag < _FLOAT_MAX:
+            # the "pair" is actually a little-endian double, so reinterpret the bytes that were just read
+            return _DOUBLE.unpack_from(self._buf, start_offset)[0]
+
+        if _NULL_TAG <= tag <= _INT32_TAG:
+            # NULL, UNDEFINED, BOOLEAN and INT32 are the bulk of most clones and need nothing beyond the pair
+            if tag == _INT32_TAG:
+                return data if data < 0x80000000 else data - 0x100000000
+            if tag == _BOOLEAN_TAG:
+                return data != 0
+            return None if tag == _NULL_TAG else self.UNDEFINED
+
+        pair = _new_pair((data, tag))
 
         # todo: v1 typed arrays?
 
-        match pair.tag:
-            case StructuredDataType.NULL:
-                return None
-            case StructuredDataType.UNDEFINED:
-                return self.UNDEFINED
-            case StructuredDataType.BOOLEAN | StructuredDataType.BOOLEAN_OBJECT:
-                result = pair.data != 0
-                if pair.tag == StructuredDataType.BOOLEAN_OBJECT:
-                    self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.INT32:
-                result = pair.data
-                if result & 0x80000000 != 0:  # hack twos-compliment
-                    result -= 0x100000000
-                return result
-            case StructuredDataType.STRING | StructuredDataType.STRING_OBJECT:
-                result = self._read_string_internal(pair)
-                if pair.tag == StructuredDataType.STRING_OBJECT:
-                    self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.DATE_OBJECT:
-                value = self._read_double()
-                result = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=value)
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.REGEXP_OBJECT:
-                pattern = self._read_string()
-                result = re.compile(pattern)
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.BIGINT | StructuredDataType.BIGINT_OBJECT:
-                result = self._read_bigint(pair)
-                if pair.tag == StructuredDataType.BIGINT_OBJECT:
-                    self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.NUMBER_OBJECT:
-                result = self._read_double()
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.BACK_REFERENCE_OBJECT:
-                return self._flattened_objects[pair.data]
-            case StructuredDataType.ARRAY_OBJECT:
-                return self._read_array(pair)  # added to flattened_objects in the method
-            case StructuredDataType.OBJECT_OBJECT:
-                return self._read_object(pair)  # added to flattened_objects in the method
-            case StructuredDataType.TYPED_ARRAY_OBJECT | StructuredDataType.TYPED_ARRAY_OBJECT_V2:
-                # have to add a dummy object for this type and replace at the end:
-                self._flattened_objects.append(self.UNDEFINED)
-                dummy_object_index = len(self._flattened_objects) - 1
-                result = self._read_typed_array(pair, False)
-                self._flattened_objects[dummy_object_index] = result
-                return result
-            case StructuredDataType.MAP_OBJECT:
-                return self._read_map(pair)
-            case StructuredDataType.SET_OBJECT:
-                return self._read_set(pair)  # added to flattened_objects in the method
-            case StructuredDataType.ARRAY_BUFFER_OBJECT:
-                array_length = self._read_ulong()
-                _, result = self._read_raw(array_length)
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.ARRAY_BUFFER_OBJECT_V2:
-                array_length = pair.data
-                _, result = self._read_raw(array_length)
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.DOM_BLOB:
-                return self._read_blob(pair)
-            case StructuredDataType.DOM_FILE | StructuredDataType.DOM_FILE_WITHOUT_LASTMODIFIEDDATE:
-                result = self._read_file(pair)
-                self._flattened_objects.append(result)
-                return result
-            case StructuredDataType.DOM_FILELIST:
-                raise NotImplementedError()
-            case StructuredDataType.DOM_CRYPTOKEY:
-                return self.read_cryptokey(pair)
-            case StructuredDataType.END_OF_KEYS:
-                raise EndOfKeysException()
-            case _:
-                raise NotImplementedError(f"datatype not supported: {pair.tag.name}")
+        handler = StructuredCloneReader._READ_HANDLERS.get(pair.tag)
+        if handler is None:
+            raise NotImplementedError(f"datatype not supported: {_tag_name(pair.tag)}")
+        return handler(self, pair)
+
+    # the handlers for each tag, called by _read with the pair which has been read
+
+    def _handle_boolean_object(self, pair: Pair):
+        result = pair.data != 0
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_int32(self, pair: Pair):
+        # the data was unpacked as a uint32, so reinterpret it as two's complement
+        data = pair.data
+        return data if data < 0x80000000 else data - 0x100000000
+
+    def _handle_string(self, pair: Pair):
+        result = self._read_string_internal(pair)
+        if pair.tag == StructuredDataType.STRING_OBJECT:
+            self._add_flattened_object(result)
+        return result
+
+    def _handle_date(self, pair: Pair):
+        result = _js_time_to_datetime(self._read_double())
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_regexp(self, pair: Pair):
+        pattern = self._read_string()
+        result = _compile_regexp(pattern)
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_bigint(self, pair: Pair):
+        result = self._read_bigint(pair)
+        if pair.tag == StructuredDataType.BIGINT_OBJECT:
+            self._add_flattened_object(result)
+        return result
+
+    def _handle_number_object(self, pair: Pair):
+        result = self._read_double()
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_back_reference(self, pair: Pair):
+        return self._flattened_objects[pair.data]
+
+    def _handle_typed_array(self, pair: Pair):
+        # have to add a dummy object for this type and replace at the end:
+        self._add_flattened_object(self.UNDEFINED)
+        dummy_object_index = len(self._flattened_objects) - 1
+        result = self._read_typed_array(pair, False)
+        self._flattened_objects[dummy_object_index] = result
+        return result
+
+    def _handle_array_buffer(self, pair: Pair):
+        array_length = self._read_ulong()
+        result = self._read_bytes(array_length)
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_array_buffer_v2(self, pair: Pair):
+        array_length = pair.data
+        result = self._read_bytes(array_length)
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_file(self, pair: Pair):
+        result = self._read_file(pair)
+        self._add_flattened_object(result)
+        return result
+
+    def _handle_filelist(self, pair: Pair):
+        raise NotImplementedError()
+
+    def _handle_end_of_keys(self, pair: Pair):
+        return _KEYS_ENDED
+
+    # keyed on the plain int values, as the tags are left as ints when read. NULL, UNDEFINED, BOOLEAN and INT32 are
+    # dealt with directly in _read so don't appear here
+    _READ_HANDLERS = {
+        StructuredDataType.BOOLEAN_OBJECT.value: _handle_boolean_object,
+        StructuredDataType.STRING.value: _handle_string,
+        StructuredDataType.STRING_OBJECT.value: _handle_string,
+        StructuredDataType.DATE_OBJECT.value: _handle_date,
+        StructuredDataType.REGEXP_OBJECT.value: _handle_regexp,
+        StructuredDataType.BIGINT.value: _handle_bigint,
+        StructuredDataType.BIGINT_OBJECT.value: _handle_bigint,
+        StructuredDataType.NUMBER_OBJECT.value: _handle_number_object,
+        StructuredDataType.BACK_REFERENCE_OBJECT.value: _handle_back_reference,
+        StructuredDataType.ARRAY_OBJECT.value: _open_container,  # added to flattened_objects in the method
+        StructuredDataType.OBJECT_OBJECT.value: _open_container,  # added to flattened_objects in the method
+        StructuredDataType.TYPED_ARRAY_OBJECT.value: _handle_typed_array,
+        StructuredDataType.TYPED_ARRAY_OBJECT_V2.value: _handle_typed_array,
+        StructuredDataType.MAP_OBJECT.value: _open_container,  # added to flattened_objects in the method
+        StructuredDataType.SET_OBJECT.value: _open_container,  # added to flattened_objects in the method
+        StructuredDataType.ARRAY_BUFFER_OBJECT.value: _handle_array_buffer,
+        StructuredDataType.ARRAY_BUFFER_OBJECT_V2.value: _handle_array_buffer_v2,
+        StructuredDataType.DOM_BLOB.value: _read_blob,
+        StructuredDataType.DOM_FILE.value: _handle_file,
+        StructuredDataType.DOM_FILE_WITHOUT_LASTMODIFIEDDATE.value: _handle_file,
+        StructuredDataType.DOM_FILELIST.value: _handle_filelist,
+        StructuredDataType.DOM_CRYPTOKEY.value: read_cryptokey,
+        StructuredDataType.END_OF_KEYS.value: _handle_end_of_keys,
+    }
 
     def read_root(self):
         return self._read()
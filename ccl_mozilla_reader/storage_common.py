@@ -28,6 +28,11 @@ import typing
 
 EPOCH = datetime.datetime(1970, 1, 1)
 
+_UINT32_BE = struct.Struct(">I")
+_UINT64_BE = struct.Struct(">Q")
+# .metadata-v2: timestamp, persisted flag, then 2 reserved uint32s
+_METADATA_V2_FIXED_HEADER = struct.Struct(">QB8s")
+
 
 def parse_unix_microseconds(microseconds: int) -> datetime.datetime:
     return EPOCH + datetime.timedelta(microseconds=microseconds)
@@ -37,20 +42,32 @@ def read_unix_microseconds(stream: typing.BinaryIO) -> datetime.datetime:
     timestamp_raw = stream.read(8)
     if len(timestamp_raw) != 8:
         raise ValueError("Couldn't get enough data to read the timestamp")
-    return parse_unix_microseconds(struct.unpack(">Q", timestamp_raw)[0])
+    return parse_unix_microseconds(_UINT64_BE.unpack(timestamp_raw)[0])
 
 
 def read_cstring(stream: typing.BinaryIO):
     length_raw = stream.read(4)
     if len(length_raw) != 4:
         raise ValueError("Couldn't get enough data to read the string length")
-    length, = struct.unpack(">I", length_raw)
+    length, = _UINT32_BE.unpack(length_raw)
     string_raw = stream.read(length)
     if len(string_raw) != length:
         raise ValueError("Couldn't get enough data to read the string data")
     return string_raw.decode("utf-8")
 
 
+def _unpack_cstring(data: bytes, offset: int) -> tuple[str, int]:
+    # as per read_cstring, but from a buffer; returns the string and the offset following it
+    if offset + 4 > len(data):
+        raise ValueError("Couldn't get enough data to read the string length")
+    length, = _UINT32_BE.unpack_from(data, offset)
+    offset += 4
+    string_raw = data[offset:offset + length]
+    if len(string_raw) != length:
+        raise ValueError("Couldn't get enough data to read the string data")
+    return string_raw.decode("utf-8"), offset + length
+
+
 @dataclasses.dataclass(frozen=True)
 class MetadataV2:
     # dom/quota/ActorsParent.cpp - StorageOperationBase::GetDirectoryMetadata2
@@ -64,13 +81,20 @@ class MetadataV2:
 
     @classmethod
     def from_file(cls, path: pathlib.Path):
-        with path.open("rb") as f:
-            timestamp = read_unix_microseconds(f)
-            persisted = f.read(1)[0] != 0
-            reserved_1_and_2 = f.read(8)
-            suffix = read_cstring(f)
-            group = read_cstring(f)
-            origin = read_cstring(f)
-            is_app = f.read(1)[0] != 0
-
-        return cls(timestamp, persisted, suffix, group, origin, is_app)
\ No newline at end of file
+        # the files are tiny, so read it in one go and parse from memory
+        return cls.from_bytes(path.read_bytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if len(data) < _METADATA_V2_FIXED_HEADER.size:
+            raise ValueError("Couldn't get enough data to read the timestamp")
+        timestamp_raw, persisted, reserved_1_and_2 = _METADATA_V2_FIXED_HEADER.unpack_from(data)
+        offset = _METADATA_V2_FIXED_HEADER.size
+        suffix, offset = _unpack_cstring(data, offset)
+        group, offset = _unpack_cstring(data, offset)
+        origin, offset = _unpack_cstring(data, offset)
+        if offset >= len(data):
+            raise ValueError("Couldn't get enough data to read the is_app flag")
+        is_app = data[offset]
+
+        return cls(parse_unix_microseconds(timestamp_raw), persisted != 0, suffix, group, origin, is_app != 0)
\ No newline at end of file
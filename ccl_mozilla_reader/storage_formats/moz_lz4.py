@@ -25,7 +25,14 @@ import pathlib
 import struct
 import lz4.block
 
+# orjson is optional, but when installed it parses the (often multi-megabyte) session store JSON considerably faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 MAGIC = b"mozLz40\x00"
+_DECOMPRESSED_LENGTH = struct.Struct("<I")
 
 
 def decompress(compressed: bytes) -> bytes:
@@ -36,7 +43,7 @@ def decompress(compressed: bytes) -> bytes:
         raise ValueError(f"Magic doesn't match. Expected: {MAGIC.hex(" ", 1)}; got: {compressed[0:len(MAGIC)].hex(" ", 1)}")
 
     length_offset = len(MAGIC)
-    decompressed_length, = struct.unpack("<I", compressed[length_offset: length_offset + 4])
+    decompressed_length, = _DECOMPRESSED_LENGTH.unpack_from(compressed, length_offset)
 
     data_start_offset = length_offset + 4
     decompressed = lz4.block.decompress(compressed[data_start_offset:], decompressed_length)
@@ -48,7 +55,16 @@ def load_jsonlz4(path: pathlib.Path):
     with path.open("rb") as f:
         data = f.read()
 
-    return json.loads(decompress(data))
+    return loads_json(decompress(data))
+
+
+def loads_json(data: bytes):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # orjson is stricter (e.g. lone surrogates, very large integers), so let the json module try
+    return json.loads(data)
 
 # if __name__ == '__main__':
 #     with open(sys.argv[1], "rb") as f: